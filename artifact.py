@@ -0,0 +1,275 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It writes and reads the limits as a binary artifact, which can be memory-mapped without parsing.
+
+It performs the following tasks:
+
+Library Imports:
+Imports hashlib and json for the header, and numpy for the limits.
+
+Artifact Format:
+Every artifact is a pair of files with the same name:
+<name>.npy - the limits as a float64 array, with a row for every category and a column for every quantile,
+so the limits of every category are contiguous in memory.
+<name>.json - the header: the format version, the category codes, the quantile grid,
+the shape and dtype of the array and the SHA-256 checksum of the array data,
+and the SHA-256 checksum of the CSV file the limits were exported to with them (such as limits.csv),
+so a reader can tell whether the artifact still matches the CSV file.
+A multi-year store has another leading axis, with the limits of every survey year,
+and the years in its header.
+A subgroup store has another leading axis, with the limits of every group of households,
+and the grouping columns and the key of every group in its header.
+
+Function Definitions:
+source_checksum(file): Calculates the SHA-256 checksum of the CSV file of an artifact.
+write_artifact(file, limits, probs, categories, source=None): Writes the limits and their header.
+load_artifact(file, verify=True): Memory-maps the limits, after checking the header and the checksum.
+write_store(file, limits, probs, categories): Writes the limits of several survey years as one artifact.
+load_store(file, verify=True): Memory-maps the limits of every survey year.
+write_groups(file, limits, columns, keys, probs, categories): Writes the limits of every group of households as one artifact.
+load_groups(file, verify=True): Memory-maps the limits of every group, indexed by the group key.
+"""
+
+# Importing the required libraries.
+import hashlib
+import json
+import numpy as np
+
+# The version of the artifact format.
+VERSION = 1
+
+def _checksum(values):
+    """
+    Calculates the SHA-256 checksum of an array's data.
+
+    Parameters
+    ----------
+    values : numpy array
+        The array.
+
+    Returns
+    -------
+    str
+        The checksum, as a hexadecimal string.
+    """
+    return hashlib.sha256(np.ascontiguousarray(values).data).hexdigest()
+
+def source_checksum(file):
+    """
+    Calculates the SHA-256 checksum of the CSV file of an artifact.
+    Line endings are normalized to '\n' first, so a checkout or a write with Windows line endings has the same checksum.
+
+    Parameters
+    ----------
+    file : Path object
+        The CSV file.
+
+    Returns
+    -------
+    str
+        The checksum, as a hexadecimal string.
+    """
+    return hashlib.sha256(file.read_bytes().replace(b'\r\n', b'\n')).hexdigest()
+
+def write_artifact(file, limits, probs, categories, source=None):
+    """
+    Writes the limits as a binary artifact.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix. The .npy and .json suffixes are added.
+    limits : array like
+        The limits, with a row for every quantile and a column for every category, as in limits.csv.
+    probs : array like
+        The quantile of every row, including the open upper limit (1.0).
+    categories : list
+        The category code of every column.
+    source : Path object, optional
+        The CSV file the same limits were already written to. Its checksum is stored in the header.
+        The default is None, for an artifact without a CSV file.
+    """
+    values = np.ascontiguousarray(np.asarray(limits, dtype=np.float64).T)
+    np.save(file.with_suffix('.npy'), values)
+    header = {'version' : VERSION,
+              'categories' : [str(c) for c in categories],
+              'probs' : [float(p) for p in probs],
+              'dtype' : values.dtype.str,
+              'shape' : list(values.shape),
+              'sha256' : _checksum(values)}
+    if source is not None:
+        header['source_sha256'] = source_checksum(source)
+    file.with_suffix('.json').write_text(json.dumps(header, indent=1))
+
+def _load(file, verify):
+    """
+    Memory-maps the array of a binary artifact, after checking its header.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix.
+    verify : bool
+        Check the checksum of the array data.
+
+    Raises
+    ------
+    ValueError
+        If the artifact has a different version, or does not match its header.
+
+    Returns
+    -------
+    tuple
+        The read-only array and the header.
+    """
+    header = json.loads(file.with_suffix('.json').read_text())
+    if header['version'] != VERSION:
+        raise ValueError(f"{file} has artifact version {header['version']}, expected {VERSION}")
+    values = np.load(file.with_suffix('.npy'), mmap_mode='r')
+    if list(values.shape) != header['shape'] or values.dtype.str != header['dtype']:
+        raise ValueError(f'{file} does not match the shape and dtype in its header')
+    if verify and _checksum(values) != header['sha256']:
+        raise ValueError(f'{file} does not match the checksum in its header')
+    return values, header
+
+def load_artifact(file, verify=True):
+    """
+    Memory-maps the limits of a binary artifact.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix.
+    verify : bool, optional
+        Check the checksum of the array data. The default is True.
+
+    Raises
+    ------
+    ValueError
+        If the artifact has a different version, or does not match its header.
+
+    Returns
+    -------
+    tuple
+        A dict of the read-only limits of every category, indexed by the category code, and the header.
+    """
+    values, header = _load(file, verify)
+    if 'years' in header or 'groups' in header:
+        raise ValueError(f'{file} is a multi-year or subgroup store, load it with load_store or load_groups')
+    return dict(zip(header['categories'], values)), header
+
+def write_store(file, limits, probs, categories):
+    """
+    Writes the limits of several survey years as one binary artifact.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix. The .npy and .json suffixes are added.
+    limits : dict
+        The limits of every year, with a row for every quantile and a column for every category, as in limits.csv.
+        All the years must have the same quantiles and categories.
+    probs : array like
+        The quantile of every row, including the open upper limit (1.0).
+    categories : list
+        The category code of every column.
+    """
+    years = sorted(limits)
+    values = np.ascontiguousarray(np.stack([np.asarray(limits[y], dtype=np.float64).T for y in years]))
+    np.save(file.with_suffix('.npy'), values)
+    header = {'version' : VERSION,
+              'years' : [int(y) for y in years],
+              'categories' : [str(c) for c in categories],
+              'probs' : [float(p) for p in probs],
+              'dtype' : values.dtype.str,
+              'shape' : list(values.shape),
+              'sha256' : _checksum(values)}
+    file.with_suffix('.json').write_text(json.dumps(header, indent=1))
+
+def load_store(file, verify=True):
+    """
+    Memory-maps the limits of every survey year of a multi-year store.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix.
+    verify : bool, optional
+        Check the checksum of the array data. The default is True.
+
+    Raises
+    ------
+    ValueError
+        If the artifact is not a multi-year store, has a different version, or does not match its header.
+
+    Returns
+    -------
+    tuple
+        A dict of the limits of every year, each a dict of the read-only limits of every category,
+        and the header.
+    """
+    values, header = _load(file, verify)
+    if 'years' not in header:
+        raise ValueError(f'{file} is not a multi-year store, load it with load_artifact')
+    return {y : dict(zip(header['categories'], v)) for y, v in zip(header['years'], values)}, header
+
+def write_groups(file, limits, columns, keys, probs, categories):
+    """
+    Writes the limits of every group of households as one binary artifact.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix. The .npy and .json suffixes are added.
+    limits : array like
+        The limits (groups, quantiles, categories), as calculated by grouped_weighted_quantiles.
+    columns : list
+        The names of the survey columns the households are grouped by.
+    keys : list
+        The key of every group: a list with the value of every grouping column.
+    probs : array like
+        The quantile of every row, including the open upper limit (1.0).
+    categories : list
+        The category code of every column.
+    """
+    values = np.ascontiguousarray(np.asarray(limits, dtype=np.float64).transpose(0, 2, 1))
+    np.save(file.with_suffix('.npy'), values)
+    header = {'version' : VERSION,
+              'group_columns' : [str(c) for c in columns],
+              'groups' : [[k.item() if hasattr(k, 'item') else k for k in key] for key in keys],
+              'categories' : [str(c) for c in categories],
+              'probs' : [float(p) for p in probs],
+              'dtype' : values.dtype.str,
+              'shape' : list(values.shape),
+              'sha256' : _checksum(values)}
+    file.with_suffix('.json').write_text(json.dumps(header, indent=1))
+
+def load_groups(file, verify=True):
+    """
+    Memory-maps the limits of every group of households of a subgroup store.
+
+    Parameters
+    ----------
+    file : Path object
+        The artifact file name without a suffix.
+    verify : bool, optional
+        Check the checksum of the array data. The default is True.
+
+    Raises
+    ------
+    ValueError
+        If the artifact is not a subgroup store, has a different version, or does not match its header.
+
+    Returns
+    -------
+    tuple
+        A dict of the limits of every group, indexed by the group key as a tuple,
+        each a dict of the read-only limits of every category, and the header.
+    """
+    values, header = _load(file, verify)
+    if 'groups' not in header:
+        raise ValueError(f'{file} is not a subgroup store, load it with load_artifact')
+    return {tuple(k) : dict(zip(header['categories'], v)) for k, v in zip(header['groups'], values)}, header
@@ -0,0 +1,166 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It calculates the expenditure deciles of a large households file without the Streamlit app.
+
+It performs the following tasks:
+
+Library Imports:
+Imports numpy for numerical operations, and load_limits, nefesh_btl and classify from classifier.py.
+pandas is imported only when the households file is read, so importing this script stays fast.
+
+Function Definitions:
+iter_chunks(file, columns, chunksize): Reads a CSV or Parquet households file chunk by chunk,
+reading only the required columns.
+classify_chunk(chunk, limits, persons, categories, keep=()): Calculates the expenditure per standardized
+person of every household in the chunk and finds its decile in every category.
+Households with a missing expenditure or a missing or invalid number of persons get a missing decile,
+an empty cell in CSV files and a null in Parquet files.
+write_chunks(chunks, file): Writes the classified chunks one after the other to a CSV or Parquet file.
+
+Usage:
+python batch_classify.py households.csv deciles.csv
+python batch_classify.py households.parquet deciles.parquet --categories c3 c30 --keep misparmb
+
+Only a single chunk is held in memory at a time, so the memory use does not depend on the size of the file.
+"""
+
+# Importing the required libraries.
+import argparse
+import numpy as np
+from pathlib import Path
+from classifier import load_limits, nefesh_btl, classify
+
+def iter_chunks(file, columns, chunksize):
+    """
+    Reads a households file chunk by chunk.
+
+    Parameters
+    ----------
+    file : Path object
+        The CSV or Parquet file to be read.
+    columns : list
+        The lowercase names of the columns to read.
+    chunksize : int
+        The number of rows in every chunk.
+
+    Yields
+    ------
+    DataFrame
+        A chunk of the file, with lowercase column names.
+    """
+    wanted = set(columns)
+    if file.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(file)
+        # Matching the required columns regardless of their case in the file.
+        names = [n for n in parquet_file.schema_arrow.names if n.lower() in wanted]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=names):
+            chunk = batch.to_pandas()
+            chunk.columns = chunk.columns.str.lower()
+            yield chunk
+    else:
+        import pandas as pd
+        for chunk in pd.read_csv(file, usecols=lambda c: c.lower() in wanted, chunksize=chunksize):
+            chunk.columns = chunk.columns.str.lower()
+            yield chunk
+
+def classify_chunk(chunk, limits, persons, categories, keep=()):
+    """
+    Finds the deciles of every household in a chunk.
+
+    Parameters
+    ----------
+    chunk : DataFrame
+        The households, with the number of persons and the expenditure of every category.
+    limits : dict
+        The decile limits of every category, as loaded by load_limits.
+    persons : str
+        The name of the column with the number of persons in the household.
+    categories : list
+        The categories to classify.
+    keep : list, optional
+        Columns to copy as they are to the results. The default is ().
+
+    Returns
+    -------
+    DataFrame
+        The kept columns and the decile of every category, in '<category>_decile' columns.
+        Households with a missing expenditure or a missing (or less than one) number of persons get a missing decile.
+    """
+    import pandas as pd
+    # Calculating the standardized number of persons of every household.
+    scale = nefesh_btl(chunk[persons].to_numpy(dtype=float, na_value=np.nan))
+
+    # Calculating the expenditure per person and finding the deciles.
+    exp_pp = {c : chunk[c].to_numpy(dtype=float, na_value=np.nan) / scale for c in categories}
+    deciles = classify(limits, exp_pp, categories)
+
+    results = chunk.loc[:, list(keep)].copy()
+    for c in categories:
+        # A value which is not finite has no decile, so it is masked instead of getting the top decile.
+        missing = ~np.isfinite(exp_pp[c])
+        results[c + '_decile'] = pd.arrays.IntegerArray(np.where(missing, 0, deciles[c]).astype(np.int16), missing)
+    return results
+
+def write_chunks(chunks, file):
+    """
+    Writes the classified chunks to a CSV or Parquet file.
+
+    Parameters
+    ----------
+    chunks : iterable
+        The classified chunks, as DataFrames with the same columns.
+    file : Path object
+        The file to write to. Overwritten if it already exists.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    rows = 0
+    if file.suffix == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(file, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(file, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            rows += len(chunk)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calculates the expenditure deciles of a CSV or Parquet households file.')
+    parser.add_argument('input', type=Path, help='The households file, with the number of persons and the monthly expenditure of every category.')
+    parser.add_argument('output', type=Path, help='The file to write the deciles to (.csv or .parquet).')
+    parser.add_argument('--limits', type=Path, default=Path('./data/limits.csv'), help='The decile limits file.')
+    parser.add_argument('--persons', default='nefesh', help='The column with the number of persons in the household.')
+    parser.add_argument('--categories', nargs='+', help='The categories to classify. The default is every category in the limits file.')
+    parser.add_argument('--keep', nargs='+', default=[], help='Columns to copy to the output, such as a household id.')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='The number of rows to read at a time.')
+    args = parser.parse_args(argv)
+
+    limits = load_limits(args.limits)
+    categories = args.categories or list(limits)
+    keep = [k.lower() for k in args.keep]
+    persons = args.persons.lower()
+
+    chunks = iter_chunks(args.input, [persons] + categories + keep, args.chunksize)
+    rows = write_chunks((classify_chunk(chunk, limits, persons, categories, keep) for chunk in chunks), args.output)
+    print(f'Classified {rows} households into {args.output}')
+
+if __name__ == '__main__':
+    main()
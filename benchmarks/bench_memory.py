@@ -0,0 +1,107 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It measures the memory held by the limits when many sessions of exp_decile.py are open at once.
+
+It performs the following tasks:
+
+Scenarios:
+copies - every session gets its own copy of the limits DataFrame, read with pd.read_csv,
+the way st.cache_data returns a pickled copy to every caller.
+shared - the limits are loaded once with load_limits (the binary artifact if it exists) and every session
+holds a reference to the same read-only arrays, the way load_data with st.cache_resource does.
+
+Benchmark:
+Opens --sessions sessions of every scenario in a new Python process, and prints the memory allocated
+by Python (measured with tracemalloc) and the peak resident memory of the process.
+Memory-mapped artifact pages are not allocated by Python: they are in the page cache,
+shared by all the processes of the machine, so only the resident memory counts them.
+
+Usage:
+python benchmarks/bench_memory.py
+python benchmarks/bench_memory.py --sessions 1 100 1000 --limits data/limits_100.csv
+"""
+
+# Importing the required libraries.
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+# The project folder, where the scenarios run.
+ROOT = Path(__file__).resolve().parents[1]
+
+# Every scenario opens SESSIONS sessions, each holding the limits of LIMITS.
+SCENARIOS = {
+'copies' : """
+import pickle
+import pandas as pd
+from classifier import nefesh_btl, find_rank
+limits = pd.read_csv(LIMITS, index_col='p')
+tracemalloc.start()
+sessions = [pickle.loads(pickle.dumps(limits)) for _ in range(SESSIONS)]
+decile = find_rank(sessions[-1]['c3'].to_numpy(), 12000 / nefesh_btl(4))
+""",
+'shared' : """
+from classifier import load_limits, nefesh_btl, find_rank
+import pandas as pd
+tracemalloc.start()
+limits = load_limits(LIMITS)
+sessions = [limits for _ in range(SESSIONS)]
+decile = find_rank(sessions[-1]['c3'], 12000 / nefesh_btl(4))
+"""}
+
+HEADER = """
+import tracemalloc
+LIMITS = {limits!r}
+SESSIONS = {sessions}
+"""
+
+# pandas is imported by both scenarios, so the resident memory differs only by the limits.
+REPORT = """
+import json
+import resource
+allocated = tracemalloc.get_traced_memory()[0]
+print(json.dumps({'allocated' : allocated, 'resident' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+"""
+
+def run(name, limits, sessions):
+    """
+    Runs a scenario in a new Python process.
+
+    Parameters
+    ----------
+    name : str
+        The scenario, one of SCENARIOS.
+    limits : Path object
+        The limits CSV file.
+    sessions : int
+        The number of sessions.
+
+    Returns
+    -------
+    dict
+        The bytes allocated by Python for the sessions, and the peak resident bytes of the process.
+    """
+    code = HEADER.format(limits=str(limits), sessions=sessions) + SCENARIOS[name] + REPORT
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the memory of the limits under many sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 100, 1000], help='The numbers of sessions.')
+    parser.add_argument('--limits', type=Path, default=ROOT / 'data' / 'limits.csv', help='The limits CSV file.')
+    args = parser.parse_args(argv)
+
+    print(f"{'scenario':>10} {'sessions':>10} {'allocated':>12} {'per session':>12} {'resident':>12}")
+    for name in SCENARIOS:
+        for sessions in args.sessions:
+            memory = run(name, args.limits.resolve(), sessions)
+            print(f"{name:>10} {sessions:>10} {memory['allocated'] / 1024:>10.1f}KB "
+                  f"{memory['allocated'] / sessions / 1024:>10.2f}KB {memory['resident'] / 2 ** 20:>10.1f}MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It compares weighted_quantiles from quantiles.py with DescrStatsW from statsmodels.
+
+It performs the following tasks:
+
+Synthetic Survey:
+Creates random per-person expenditures for 11 categories, with a share of zero expenditures
+and repeated values as in the real survey, and random weights.
+
+Benchmark:
+Times DescrStatsW(...).quantile and weighted_quantiles on the same data for every size,
+checks that both give exactly the same deciles, and prints the speedup.
+
+Usage:
+python benchmarks/bench_quantiles.py
+python benchmarks/bench_quantiles.py --sizes 6000 100000 1000000 --repeat 5
+"""
+
+# Importing the required libraries.
+import argparse
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from quantiles import weighted_quantiles
+
+# The decile limits to calculate.
+PROBS = np.round(np.arange(0.1,1,step=0.1), 1)
+
+def synthetic_survey(rows, seed=0):
+    """
+    Creates random per-person expenditures and weights.
+
+    Parameters
+    ----------
+    rows : int
+        The number of households.
+    seed : int, optional
+        The random seed. The default is 0.
+
+    Returns
+    -------
+    tuple
+        The per-person expenditures (rows, 11) and the weights.
+    """
+    rng = np.random.default_rng(seed)
+    nefesh = rng.choice([1.25, 2, 2.65, 3.2, 3.75, 4.25, 4.75, 5.2], rows)
+    expenditures = np.round(rng.gamma(2, 1500, (rows, 11)))
+    expenditures[rng.random((rows, 11)) < 0.2] = 0
+    return expenditures / nefesh[:, None], rng.uniform(50, 500, rows)
+
+def best_time(func, repeat):
+    """
+    Times a function.
+
+    Parameters
+    ----------
+    func : function
+        The function to time, with no arguments.
+    repeat : int
+        The number of runs.
+
+    Returns
+    -------
+    tuple
+        The shortest run time in seconds and the result of the function.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares weighted_quantiles with DescrStatsW.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[6_000, 100_000, 1_000_000], help='The numbers of households.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs of every benchmark.')
+    args = parser.parse_args(argv)
+    from statsmodels.stats.weightstats import DescrStatsW as dsw
+
+    print(f"{'rows':>12} {'DescrStatsW':>12} {'kernel':>12} {'speedup':>8} {'equal':>6}")
+    for rows in args.sizes:
+        values, weights = synthetic_survey(rows)
+        dsw_time, expected = best_time(lambda: dsw(values, weights).quantile(PROBS, return_pandas=False), args.repeat)
+        kernel_time, result = best_time(lambda: weighted_quantiles(values, weights, PROBS), args.repeat)
+        equal = np.array_equal(expected, result)
+        print(f'{rows:>12} {dsw_time:>11.4f}s {kernel_time:>11.4f}s {dsw_time / kernel_time:>7.1f}x {str(equal):>6}')
+
+if __name__ == '__main__':
+    main()
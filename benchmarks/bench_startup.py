@@ -0,0 +1,99 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It measures the cold start of a new process that classifies a single household.
+
+It performs the following tasks:
+
+Scenarios:
+core - imports classifier.py, loads the limits with load_limits (the binary artifact if it exists)
+and finds the decile of one expenditure.
+pandas - imports pandas, reads limits.csv with pd.read_csv and finds the decile of one expenditure,
+the way exp_decile.py used to.
+
+Benchmark:
+Runs every scenario in a new Python process again and again, and prints the median time of the imports,
+the limits loading and the first classification, measured inside the process, and of the whole process
+including the interpreter start.
+
+Usage:
+python benchmarks/bench_startup.py
+python benchmarks/bench_startup.py --repeat 20
+"""
+
+# Importing the required libraries.
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# The project folder, where the scenarios run.
+ROOT = Path(__file__).resolve().parents[1]
+
+# Every scenario prints the import, load and classification times as JSON.
+SCENARIOS = {
+'core' : """
+import time
+start = time.perf_counter()
+from classifier import load_limits, nefesh_btl, find_rank
+imported = time.perf_counter()
+limits = load_limits('data/limits.csv')
+loaded = time.perf_counter()
+decile = find_rank(limits['c3'], 12000 / nefesh_btl(4))
+classified = time.perf_counter()
+""",
+'pandas' : """
+import time
+start = time.perf_counter()
+import pandas as pd
+from classifier import nefesh_btl, find_rank
+imported = time.perf_counter()
+limits = pd.read_csv('data/limits.csv', index_col='p')
+loaded = time.perf_counter()
+decile = find_rank(limits['c3'], 12000 / nefesh_btl(4))
+classified = time.perf_counter()
+"""}
+
+REPORT = """
+import json
+print(json.dumps({'import' : imported - start, 'load' : loaded - imported, 'classify' : classified - loaded}))
+"""
+
+def run(code):
+    """
+    Runs a scenario in a new Python process.
+
+    Parameters
+    ----------
+    code : str
+        The scenario.
+
+    Returns
+    -------
+    dict
+        The import, load, classify and whole process times in seconds.
+    """
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code + REPORT], cwd=ROOT, capture_output=True, text=True, check=True)
+    times = json.loads(out.stdout)
+    times['process'] = time.perf_counter() - start
+    return times
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the cold start of classifying a single household.')
+    parser.add_argument('--repeat', type=int, default=10, help='The number of processes to run for every scenario.')
+    args = parser.parse_args(argv)
+
+    print(f"{'scenario':>10} {'import':>10} {'load':>10} {'classify':>10} {'process':>10}")
+    for name, code in SCENARIOS.items():
+        runs = [run(code) for _ in range(args.repeat)]
+        medians = {k : statistics.median(r[k] for r in runs) * 1000 for k in runs[0]}
+        print(f"{name:>10} {medians['import']:>8.1f}ms {medians['load']:>8.2f}ms {medians['classify']:>8.3f}ms {medians['process']:>8.1f}ms")
+
+if __name__ == '__main__':
+    main()
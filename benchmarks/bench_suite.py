@@ -0,0 +1,338 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It times the limits calculation and the decile lookups, and stores the results as JSON,
+so the performance can be compared between commits.
+
+It performs the following tasks:
+
+Synthetic Survey:
+Creates the per-person expenditures and weights of synthetic_survey from bench_quantiles.py
+chunk by chunk, so surveys larger than the memory (up to 100M rows and more) can be streamed.
+For the streaming engine, the chunks are written once to .npy files in a temporary folder before the timing,
+and every pass reads them back from there, so the time is of the streaming and not of generating the survey.
+
+Limits Benchmarks:
+Times the calculation of the decile limits on every size with every engine:
+descrstatsw - DescrStatsW from statsmodels, which data_creation.py used to run (skipped if not installed).
+kernel - weighted_quantiles, which data_creation.py runs by default.
+threads - weighted_quantiles with a worker thread for every CPU (data_creation.py --workers 0).
+streaming - streaming_weighted_quantiles, which data_creation.py --streaming runs, on chunks of --chunksize rows
+read from the temporary files.
+The in-memory engines run only up to --max-memory-rows rows. Every engine is checked against the kernel,
+and the largest distance from its limits is stored.
+
+Lookup Benchmarks:
+Times the decile lookups of --lookups households, as exp_decile.py, batch_classify.py and service.py do them:
+scalar - find_rank for one household at a time.
+batch - classify for all the households at once.
+service - POST /classify for one household at a time, with the in-process client of service.py.
+service_batch - POST /classify/batch for all the households at once.
+
+Results:
+Prints every result, and writes them with the commit, the versions and the machine to
+benchmarks/results/<commit>.json (or --output). With --compare, every time is also printed
+as a ratio to the same benchmark in an earlier results file.
+
+Usage:
+python benchmarks/bench_suite.py
+python benchmarks/bench_suite.py --sizes 10000 1000000 100000000 --engines kernel streaming
+python benchmarks/bench_suite.py --compare benchmarks/results/<commit>.json
+"""
+
+# Importing the required libraries.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+from bench_quantiles import PROBS, synthetic_survey, best_time
+from classifier import load_limits, find_rank, classify, nefesh_btl
+from quantiles import weighted_quantiles, streaming_weighted_quantiles
+
+# The limits engines.
+ENGINES = ['descrstatsw', 'kernel', 'threads', 'streaming']
+
+# The lookup modes.
+MODES = ['scalar', 'batch', 'service', 'service_batch']
+
+def synthetic_chunks(rows, chunksize, seed=0):
+    """
+    Creates a synthetic survey chunk by chunk.
+
+    Parameters
+    ----------
+    rows : int
+        The number of households.
+    chunksize : int
+        The number of households in every chunk.
+    seed : int, optional
+        The random seed. The default is 0.
+
+    Yields
+    ------
+    tuple
+        The per-person expenditures (chunk rows, 11) and the weights of every chunk.
+    """
+    for i, start in enumerate(range(0, rows, chunksize)):
+        yield synthetic_survey(min(chunksize, rows - start), seed=(seed, i))
+
+def write_chunks(folder, rows, chunksize):
+    """
+    Writes a synthetic survey to .npy files, chunk by chunk.
+
+    Parameters
+    ----------
+    folder : Path object
+        The folder to write 'values.npy' and 'weights.npy' to.
+    rows : int
+        The number of households.
+    chunksize : int
+        The number of households in every chunk.
+    """
+    # synthetic_survey creates 11 categories.
+    values = np.lib.format.open_memmap(folder / 'values.npy', mode='w+', dtype=float, shape=(rows, 11))
+    weights = np.lib.format.open_memmap(folder / 'weights.npy', mode='w+', dtype=float, shape=(rows,))
+    for start, (v, w) in zip(range(0, rows, chunksize), synthetic_chunks(rows, chunksize)):
+        values[start : start + len(w)] = v
+        weights[start : start + len(w)] = w
+    values.flush()
+    weights.flush()
+    del values, weights
+
+def read_chunks(folder, chunksize):
+    """
+    Reads a synthetic survey written by write_chunks, chunk by chunk.
+
+    Parameters
+    ----------
+    folder : Path object
+        The folder of 'values.npy' and 'weights.npy'.
+    chunksize : int
+        The number of households in every chunk.
+
+    Yields
+    ------
+    tuple
+        The per-person expenditures (chunk rows, 11) and the weights of every chunk.
+    """
+    values = np.load(folder / 'values.npy', mmap_mode='r')
+    weights = np.load(folder / 'weights.npy', mmap_mode='r')
+    for start in range(0, len(weights), chunksize):
+        yield np.array(values[start : start + chunksize]), np.array(weights[start : start + chunksize])
+
+def limits_engine(engine, rows, chunksize, folder):
+    """
+    Creates a function which calculates the limits of a synthetic survey with an engine.
+
+    Parameters
+    ----------
+    engine : str
+        One of ENGINES.
+    rows : int
+        The number of households.
+    chunksize : int
+        The number of households in every chunk.
+    folder : Path object
+        A temporary folder, where the streaming engine writes the survey before it is timed.
+
+    Returns
+    -------
+    function
+        The function, with no arguments, which returns the limits (quantiles, 11).
+    """
+    if engine == 'streaming':
+        write_chunks(folder, rows, chunksize)
+        return lambda: streaming_weighted_quantiles(lambda: read_chunks(folder, chunksize), PROBS)
+    values, weights = (np.concatenate(a) for a in zip(*synthetic_chunks(rows, chunksize)))
+    if engine == 'descrstatsw':
+        from statsmodels.stats.weightstats import DescrStatsW as dsw
+        return lambda: dsw(values, weights).quantile(PROBS, return_pandas=False)
+    return lambda: weighted_quantiles(values, weights, PROBS, workers=None if engine == 'threads' else 1)
+
+def bench_limits(sizes, engines, chunksize, max_memory_rows, repeat):
+    """
+    Times the limits calculation on every size with every engine.
+
+    Parameters
+    ----------
+    sizes : list
+        The numbers of households.
+    engines : list
+        The engines, out of ENGINES.
+    chunksize : int
+        The number of households in every chunk.
+    max_memory_rows : int
+        The largest number of households for the engines which hold the whole survey in memory.
+    repeat : int
+        The number of runs of every benchmark.
+
+    Returns
+    -------
+    list
+        A result dict for every size and engine.
+    """
+    results = []
+    for rows in sizes:
+        reference = None
+        for engine in engines:
+            if engine != 'streaming' and rows > max_memory_rows:
+                continue
+            with tempfile.TemporaryDirectory() as folder:
+                seconds, limits = best_time(limits_engine(engine, rows, chunksize, Path(folder)), repeat)
+            if engine == 'kernel':
+                reference = limits
+            results.append({'benchmark' : 'limits',
+                            'name' : engine,
+                            'rows' : rows,
+                            'seconds' : seconds,
+                            'max_error' : None if reference is None else float(np.abs(np.asarray(limits) - reference).max())})
+    return results
+
+async def _service_lookups(app, request, persons, expenditures):
+    """
+    Classifies every household with a request of its own.
+
+    Parameters
+    ----------
+    app : function
+        The ASGI application.
+    request : function
+        The in-process client of service.py.
+    persons : numpy array
+        The number of persons of every household.
+    expenditures : numpy array
+        The expenditure of every household.
+
+    Returns
+    -------
+    list
+        The decile of every household.
+    """
+    deciles = []
+    for n, e in zip(persons.tolist(), expenditures.tolist()):
+        status, body = await request(app, 'POST', '/classify', json.dumps({'persons' : n, 'expenditures' : {'c3' : e}}).encode())
+        deciles.append(json.loads(body)['deciles']['c3'])
+    return deciles
+
+def bench_lookups(lookups, modes, repeat):
+    """
+    Times the decile lookups of synthetic households in every mode.
+
+    Parameters
+    ----------
+    lookups : int
+        The number of households.
+    modes : list
+        The modes, out of MODES.
+    repeat : int
+        The number of runs of every benchmark.
+
+    Returns
+    -------
+    list
+        A result dict for every mode, with the time of the whole run and of a single lookup.
+    """
+    limits = load_limits(ROOT / 'data' / 'limits.csv')
+    rng = np.random.default_rng(0)
+    persons = rng.integers(1, 9, lookups)
+    expenditures = np.round(rng.gamma(2, 1500, lookups))
+    scalar_limits = limits['c3'].tolist()
+
+    runs = {'scalar' : lambda: [find_rank(scalar_limits, e / nefesh_btl(n)) for n, e in zip(persons.tolist(), expenditures.tolist())],
+            'batch' : lambda: classify(limits, {'c3' : expenditures / nefesh_btl(persons)})['c3']}
+    if {'service', 'service_batch'} & set(modes):
+        from service import create_app, request
+        app = create_app(ROOT / 'data' / 'limits.csv')
+        batch_body = json.dumps({'persons' : persons.tolist(), 'expenditures' : {'c3' : expenditures.tolist()}}).encode()
+        runs['service'] = lambda: asyncio.run(_service_lookups(app, request, persons, expenditures))
+        runs['service_batch'] = lambda: json.loads(asyncio.run(request(app, 'POST', '/classify/batch', batch_body))[1])['deciles']['c3']
+
+    results = []
+    for mode in modes:
+        seconds, deciles = best_time(runs[mode], repeat)
+        results.append({'benchmark' : 'lookup',
+                        'name' : mode,
+                        'rows' : lookups,
+                        'seconds' : seconds,
+                        'per_lookup' : seconds / lookups})
+    return results
+
+def environment():
+    """
+    Describes the commit, the versions and the machine the benchmarks ran on.
+
+    Returns
+    -------
+    dict
+        The environment.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = 'unknown'
+    return {'commit' : commit,
+            'date' : datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'machine' : platform.machine(),
+            'system' : platform.system(),
+            'cpus' : os.cpu_count()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the limits calculation and the decile lookups, and stores the results as JSON.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='The numbers of households of the limits benchmarks.')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='The limits engines.')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='The number of households in every synthetic chunk.')
+    parser.add_argument('--max-memory-rows', type=int, default=10_000_000, help='The largest survey for the engines which hold it in memory.')
+    parser.add_argument('--lookups', type=int, default=10_000, help='The number of households of the lookup benchmarks. 0 skips them.')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help='The lookup modes.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs of every benchmark.')
+    parser.add_argument('--output', type=Path, help='The results file. The default is benchmarks/results/<commit>.json.')
+    parser.add_argument('--compare', type=Path, help='An earlier results file to compare with.')
+    args = parser.parse_args(argv)
+
+    engines = list(args.engines)
+    if 'descrstatsw' in engines:
+        try:
+            import statsmodels
+        except ImportError:
+            print('statsmodels is not installed, skipping descrstatsw')
+            engines.remove('descrstatsw')
+    # The kernel is the reference of the other engines, so it runs first.
+    engines.sort(key=lambda e: e != 'kernel')
+
+    report = environment()
+    report['results'] = bench_limits(args.sizes, engines, args.chunksize, args.max_memory_rows, args.repeat)
+    if args.lookups:
+        report['results'] += bench_lookups(args.lookups, args.modes, args.repeat)
+
+    # Printing the results, and comparing them with the earlier results.
+    earlier = {}
+    if args.compare:
+        earlier = {(r['benchmark'], r['name'], r['rows']) : r['seconds'] for r in json.loads(args.compare.read_text())['results']}
+    print(f"{'benchmark':>10} {'name':>14} {'rows':>12} {'seconds':>12} {'vs earlier':>11}")
+    for r in report['results']:
+        before = earlier.get((r['benchmark'], r['name'], r['rows']))
+        ratio = f'{r["seconds"] / before:>10.2f}x' if before else f"{'-':>11}"
+        print(f"{r['benchmark']:>10} {r['name']:>14} {r['rows']:>12} {r['seconds']:>11.4f}s {ratio}")
+
+    output = args.output or ROOT / 'benchmarks' / 'results' / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=1))
+    print(f'Results written to {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It load-tests exp_decile.py with many simulated users at once, for capacity planning.
+
+It performs the following tasks:
+
+Simulated Users:
+Every user is a headless session of the app, created with AppTest from streamlit.testing,
+which runs the script with the same session state and caches as the Streamlit server does for a browser session.
+Unlike the server, AppTest reruns the whole script after every interaction, while the server reruns only
+the calculator fragment, so every latency after the first includes the styles, the title and the loading
+of the data, and is an upper bound of the latency of a browser session. The report says so.
+Every user runs in a thread of its own, as the Streamlit server runs every session in a thread of one process,
+so the users compete for the same CPU and GIL as real sessions of a single server.
+
+Interactions:
+Every user opens the app and then repeats --rounds rounds of a random but realistic sequence:
+changes the number of persons, enters a total expenditure, switches the radio to expenditure by category,
+selects one to four categories, enters an expenditure in each of them, and switches back to the total expenditure.
+Between interactions a user waits a random think time of up to --think seconds.
+Every interaction is a rerun of the app, which is timed.
+
+Errors:
+The exceptions the app shows are counted after every interaction. An interaction which fails in the harness
+(a missing widget, a timeout, or streamlit not installed) ends the session of the user, and its traceback is kept.
+The report has the first MAX_ERRORS different messages and the number of users whose sessions ended early,
+since their missing interactions change the latency percentiles.
+
+Report:
+Prints the number of interactions and errors, the interactions per second, the latency percentiles
+(p50, p90, p95, p99 and max) of every kind of interaction and of all of them, the CPU time of the process
+as a share of the wall time and of a single CPU, and the peak resident memory of the process
+(with the resource module, or psutil where it is missing, as on Windows; otherwise it is not reported).
+With --output, the report is also written as JSON.
+
+Usage:
+python benchmarks/load_test.py
+python benchmarks/load_test.py --users 50 --rounds 5 --think 0.5 --output load.json
+"""
+
+# Importing the required libraries.
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# The project folder, where the app runs.
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# The expenditure categories of the calculator.
+CATEGORIES = ['c30', 'c31', 'c32', 'c33', 'c34', 'c35', 'c36', 'c37', 'c38', 'c39']
+
+# The latency percentiles to report.
+PERCENTILES = [50, 90, 95, 99]
+
+# The largest number of different error messages kept in the report.
+MAX_ERRORS = 5
+
+# How the reruns of AppTest differ from the reruns of the server, which the report notes.
+RERUN_NOTE = ('AppTest reruns the whole script after every interaction, while the server reruns only '
+              'the calculator fragment, so the latencies are an upper bound of the server\'s')
+
+def timed(latencies, errors, kind, element):
+    """
+    Reruns the app after an interaction, and records the time of the rerun and the exceptions the app showed.
+
+    Parameters
+    ----------
+    latencies : list
+        The (kind, seconds) of every interaction so far. The interaction is appended.
+    errors : list
+        The errors so far, as messages. The exceptions of the rerun are appended.
+    kind : str
+        The kind of the interaction, such as 'persons'.
+    element : AppTest or widget
+        The app, or a widget whose value was set.
+
+    Returns
+    -------
+    AppTest
+        The app after the rerun.
+    """
+    start = time.perf_counter()
+    at = element.run()
+    latencies.append((kind, time.perf_counter() - start))
+    errors.extend(f'{kind}: the app raised {e.value}' for e in at.exception)
+    return at
+
+def simulate_user(app, rounds, think, seed, timeout):
+    """
+    Opens a session of the app and runs the interactions of a user.
+
+    Parameters
+    ----------
+    app : Path object
+        The app script.
+    rounds : int
+        The number of rounds of interactions.
+    think : float
+        The longest think time between interactions, in seconds.
+    seed : int
+        The random seed of the user.
+    timeout : float
+        The longest time of a single rerun, in seconds.
+
+    Returns
+    -------
+    tuple
+        The (kind, seconds) of every interaction, the message of every error,
+        and whether the session of the user ended before all its rounds.
+    """
+    from streamlit.testing.v1 import AppTest
+    rng = np.random.default_rng(seed)
+    latencies = []
+    errors = []
+
+    def pause():
+        if think:
+            time.sleep(rng.uniform(0, think))
+
+    try:
+        at = timed(latencies, errors, 'open', AppTest.from_file(str(app), default_timeout=timeout))
+        for _ in range(rounds):
+            pause()
+            # The number of persons is the first number input, and the total expenditure the second.
+            at = timed(latencies, errors, 'persons', at.number_input[0].set_value(int(rng.integers(1, 9))))
+            pause()
+            at = timed(latencies, errors, 'total', at.number_input[1].set_value(int(rng.integers(20, 300)) * 100))
+            pause()
+            at = timed(latencies, errors, 'radio', at.radio[0].set_value('specific'))
+            pause()
+            categories = list(rng.choice(CATEGORIES, int(rng.integers(1, 5)), replace=False))
+            at = timed(latencies, errors, 'categories', at.multiselect[0].set_value(categories))
+            # Every selected category adds a number input after the number of persons.
+            for i in range(len(categories)):
+                pause()
+                at = timed(latencies, errors, 'category', at.number_input[i + 1].set_value(int(rng.integers(0, 500)) * 10))
+            pause()
+            at = timed(latencies, errors, 'radio', at.radio[0].set_value('all'))
+    except Exception:
+        # A failed interaction (a missing widget, a timeout or streamlit itself missing) ends the session of the user,
+        # as a broken page would. The traceback is kept, since the error count alone does not tell the cause.
+        errors.append(traceback.format_exc())
+        return latencies, errors, True
+    return latencies, errors, False
+
+def peak_memory():
+    """
+    Finds the peak resident memory of the process.
+
+    Returns
+    -------
+    float or None
+        The peak resident memory in MB, or None if neither resource nor psutil can be imported.
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        # peak_wset is the peak resident memory on Windows, the only system without the resource module.
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2 ** 20
+    # ru_maxrss is in KB on Linux, and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024
+
+def summarize(seconds):
+    """
+    Calculates the latency percentiles of interactions.
+
+    Parameters
+    ----------
+    seconds : list
+        The latency of every interaction, in seconds.
+
+    Returns
+    -------
+    dict
+        The number of interactions, and the percentiles and the largest latency, in milliseconds.
+    """
+    ms = np.asarray(seconds) * 1000
+    summary = {'count' : len(ms)}
+    summary.update({f'p{p}' : float(np.percentile(ms, p)) for p in PERCENTILES})
+    summary['max'] = float(ms.max())
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-tests the Streamlit calculator with simulated users.')
+    parser.add_argument('--app', type=Path, default=ROOT / 'exp_decile.py', help='The app script.')
+    parser.add_argument('--users', type=int, default=10, help='The number of simultaneous users.')
+    parser.add_argument('--rounds', type=int, default=3, help='The number of rounds of interactions of every user.')
+    parser.add_argument('--think', type=float, default=0.0, help='The longest think time between interactions, in seconds.')
+    parser.add_argument('--timeout', type=float, default=30.0, help='The longest time of a single rerun, in seconds.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+    parser.add_argument('--output', type=Path, help='A JSON file to write the report to.')
+    args = parser.parse_args(argv)
+    try:
+        import streamlit.testing.v1
+    except ImportError as e:
+        parser.error(f'the load test runs the app with streamlit, which could not be imported ({e!r})')
+
+    # The app reads its data relative to its folder.
+    app = args.app.resolve()
+    os.chdir(app.parent)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        users = list(pool.map(lambda i: simulate_user(app, args.rounds, args.think, (args.seed, i), args.timeout),
+                              range(args.users)))
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    latencies = [l for user in users for l in user[0]]
+    errors = [e for user in users for e in user[1]]
+    report = {'users' : args.users,
+              'rounds' : args.rounds,
+              'think' : args.think,
+              'interactions' : len(latencies),
+              'errors' : len(errors),
+              'ended_users' : sum(user[2] for user in users),
+              'error_messages' : list(dict.fromkeys(errors))[:MAX_ERRORS],
+              'seconds' : wall,
+              'interactions_per_second' : len(latencies) / wall,
+              'cpu_seconds' : cpu,
+              'cpu_share' : cpu / wall,
+              'peak_rss_mb' : peak_memory(),
+              'rerun' : RERUN_NOTE,
+              'latency_ms' : {}}
+    if latencies:
+        for kind in dict.fromkeys(k for k, _ in latencies):
+            report['latency_ms'][kind] = summarize([s for k, s in latencies if k == kind])
+        report['latency_ms']['all'] = summarize([s for _, s in latencies])
+
+    # Printing the report.
+    print(f"{report['users']} users, {report['interactions']} interactions, {report['errors']} errors "
+          f"in {wall:.1f}s ({report['interactions_per_second']:.1f}/s)")
+    if report['ended_users']:
+        print(f"{report['ended_users']} users ended before all their rounds, so fewer interactions were timed")
+    for message in report['error_messages']:
+        print(message)
+    memory = 'unknown' if report['peak_rss_mb'] is None else f"{report['peak_rss_mb']:.1f}MB"
+    print(f"CPU {cpu:.1f}s ({report['cpu_share']:.0%} of one CPU), peak memory {memory}")
+    print(f'Note: {RERUN_NOTE}.')
+    print(f"{'interaction':>12} {'count':>7}" + ''.join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'max':>9}")
+    for kind, s in report['latency_ms'].items():
+        print(f"{kind:>12} {s['count']:>7}" + ''.join(f"{s['p' + str(p)]:>7.1f}ms" for p in PERCENTILES) + f"{s['max']:>7.1f}ms")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=1))
+        print(f'Report written to {args.output}')
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It classifies per-person expenditures into deciles in bulk, using the limits
+created by data_creation.py.
+
+It performs the following tasks:
+
+Library Imports:
+Imports numpy and the standard library only, so the classification can be used outside of the Streamlit app,
+and a new process can start classifying without the import time of pandas.
+Imports load_artifact, load_store, load_groups and source_checksum from artifact.py for memory-mapping the binary limits.
+
+Function Definitions:
+load_limits(file): Loads the read-only limits of every category, memory-mapping the binary artifact next to the CSV file
+if it exists and its header has the checksum of the CSV file, and parsing the CSV file with the csv module otherwise
+(with a warning if the artifact exists but does not match the CSV file).
+load_years(file): Loads the limits of every survey year from the multi-year store created by data_creation.py --survey.
+load_subgroups(file): Loads the limits of every group of households from the subgroup store created by data_creation.py --groups.
+nefesh_btl(nefesh): Calculates the standardized number of persons in the household based on definitions
+from the National Security Institute and the Central Bureau of Statistics, for a single household
+or for arrays of households, with a lookup table by household size.
+find_rank(limits, values): Finds the rank (1 for the first limit, 2 for the second and so on)
+of every value in an array, using a single np.searchsorted call.
+percentile_rank(limits, values): Finds the percentile of every value, for limits of any grid
+(deciles, percentiles, permilles).
+classify(limits, expenditures, categories=None, year=None): Finds the ranks of the per-person expenditures
+of several categories at once, with the limits of a given survey year.
+load_cdf(file): Loads the weighted CDF knots of every category, created by data_creation.py.
+continuous_percentile(knots, values): Finds a continuous percentile (such as 63.4) of every value,
+interpolating linearly between the CDF knots.
+
+Ranks Definition:
+A value gets the rank of the lowest limit that is strictly larger than it, the same as
+find_nearest did in exp_decile.py. Values below the first limit get rank 1,
+and values at or above the last limit get the rank of the last limit.
+When several limits are equal (a category with many zero expenditures),
+the rank of the first of them is returned.
+The ranks are found by binary search, so the lookup time grows only with the logarithm of the number of limits.
+"""
+
+# Importing the required libraries.
+import csv
+import warnings
+import numpy as np
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from artifact import load_artifact, load_store, load_groups, source_checksum
+
+def load_limits(file):
+    """
+    Loads the limits of every category.
+
+    Parameters
+    ----------
+    file : Path object or str
+        The limits CSV file, as created by data_creation.py. If a binary artifact with the same name
+        (limits.npy and limits.json for limits.csv) exists and was created with the CSV file as it is now,
+        it is memory-mapped instead.
+
+    Returns
+    -------
+    dict
+        The read-only limits of every category, indexed by the category code.
+    """
+    file = Path(file)
+    if file.with_suffix('.npy').exists():
+        limits, header = load_artifact(file.with_suffix(''))
+        # The artifact is used only if the CSV file was not edited or created again without it.
+        if not file.exists() or header.get('source_sha256') == source_checksum(file):
+            return limits
+        warnings.warn(f"{file.with_suffix('.npy')} does not match {file}, reading {file} instead. "
+                      'Run data_creation.py again to create the artifact.')
+    with open(file, newline='') as f:
+        rows = list(csv.reader(f))
+    # The first column is the quantile of every row. The limits of every category are a row of a single
+    # read-only array, the same as in the binary artifact, so sharing them between sessions is safe.
+    values = np.ascontiguousarray(np.array(rows[1:], dtype=float)[:, 1:].T)
+    values.flags.writeable = False
+    return dict(zip(rows[0][1:], values))
+
+def load_years(file):
+    """
+    Loads the limits of every survey year.
+
+    Parameters
+    ----------
+    file : Path object or str
+        The multi-year store, such as limits_years.npy, created by data_creation.py --survey.
+
+    Returns
+    -------
+    dict
+        The limits of every year, each a dict of the limits of every category.
+    """
+    return load_store(Path(file).with_suffix(''))[0]
+
+def load_subgroups(file):
+    """
+    Loads the limits of every group of households.
+
+    Parameters
+    ----------
+    file : Path object or str
+        The subgroup store, such as limits_groups.npy, created by data_creation.py --groups.
+
+    Returns
+    -------
+    tuple
+        The limits of every group, indexed by the group key (a tuple of the values of the grouping columns),
+        each a dict of the limits of every category, and the names of the grouping columns.
+    """
+    limits, header = load_groups(Path(file).with_suffix(''))
+    return limits, header['group_columns']
+
+# The standardized number of persons of households with 1 to 8 persons.
+# From the 9th person on, every person adds 0.4.
+NEFESH_SCALE = [1.25, 2, 2.65, 3.2, 3.75, 4.25, 4.75, 5.2]
+
+# The largest household size in the lookup table. Larger households are extrapolated by 0.4 per person.
+MAX_NEFESH = 64
+
+# The standardized number of persons by household size, with NaN for size 0.
+NEFESH_TABLE = np.array([np.nan] + NEFESH_SCALE + [5.6 + (n - 9) * 0.4 for n in range(9, MAX_NEFESH + 1)])
+
+def nefesh_btl(nefesh):
+    """
+    Calculates the standardized number of persons in the household.
+
+    Parameters
+    ----------
+    nefesh : int, numpy array or Series
+        The number of persons the household has, or of every household.
+
+    Returns
+    -------
+    Float, numpy array or Series
+        The standardized number of persons in the household, 
+        according to National Security Institute and the Central Bureau of Statistics definition.
+        Households of less than one person, or with a missing number of persons, get NaN.
+    """
+    sizes = np.asarray(nefesh)
+    if sizes.dtype.kind == 'f':
+        # Missing sizes get NaN, the same as sizes of less than one person.
+        sizes = np.where(np.isfinite(sizes), sizes, 0)
+    sizes = sizes.astype(np.intp, copy=False)
+    # A single gather from the lookup table. Sizes below 0 get NaN and sizes above the table get its last value.
+    scale = np.asarray(NEFESH_TABLE.take(sizes, mode='clip'))
+    # Adding 0.4 for every person above the table.
+    large = sizes > MAX_NEFESH
+    if large.any():
+        scale[large] += (sizes[large] - MAX_NEFESH) * 0.4
+    if scale.ndim == 0:
+        return float(scale)
+    if hasattr(nefesh, 'index'):
+        return nefesh.__class__(scale, index=nefesh.index, name=nefesh.name)
+    return scale
+
+def find_rank(limits, values):
+    """
+    Finds the rank of every value in an array of values.
+
+    Parameters
+    ----------
+    limits : array like or list
+        The sorted limits of a single category, from the lowest to the highest.
+    values : array like or float
+        The per-person expenditures to be classified.
+
+    Raises
+    ------
+    ValueError
+        If a single value is given and it is not finite.
+
+    Returns
+    -------
+    numpy array or int
+        The rank of every value, starting from 1.
+        A single int is returned if a single value is given.
+        Values in an array which are not finite (such as NaN, for a missing expenditure) get a rank which
+        means nothing, so the caller must mask them with np.isfinite.
+    """
+    if isinstance(values, (int, float)):
+        if not np.isfinite(values):
+            raise ValueError(f'cannot rank {values}, the value must be finite')
+        # A single value: a binary search without creating arrays, fastest when the limits are a list.
+        if not isinstance(limits, list):
+            limits = np.asarray(limits, dtype=float)
+        return min(bisect_right(limits, values), bisect_left(limits, limits[-1])) + 1
+    limits = np.asarray(limits, dtype=float)
+    # The first limit which is strictly larger than the value.
+    idx = np.searchsorted(limits, values, side='right')
+    # Clamping values at or above the last limit to the first appearance of the last limit.
+    idx = np.minimum(idx, np.searchsorted(limits, limits[-1], side='left'))
+    return idx + 1
+
+def percentile_rank(limits, values):
+    """
+    Finds the percentile of every value in an array of values.
+
+    Parameters
+    ----------
+    limits : array like
+        The sorted limits of a single category, of any grid, as created by data_creation.py --grid.
+    values : array like or float
+        The per-person expenditures to be classified.
+
+    Returns
+    -------
+    numpy array or float
+        The percentile of every value: 10, 20, ..., 100 for deciles, 1, 2, ..., 100 for percentiles
+        and 0.1, 0.2, ..., 100 for permilles.
+    """
+    return find_rank(limits, values) * 100 / len(limits)
+
+def classify(limits, expenditures, categories=None, year=None):
+    """
+    Finds the ranks of the per-person expenditures of several categories.
+
+    Parameters
+    ----------
+    limits : DataFrame or dict
+        The limits of each category, indexed by the category code (for example 'c3').
+        With year, the limits of every year, as loaded by load_years.
+    expenditures : DataFrame or dict
+        The per-person expenditures of each category, indexed by the category code.
+    categories : list, optional
+        The categories to classify. The default is None, which means all the
+        categories in expenditures.
+    year : int, optional
+        The survey year of the limits. The default is None, for limits of a single year.
+
+    Raises
+    ------
+    ValueError
+        If there are no limits for the year.
+
+    Returns
+    -------
+    dict
+        The ranks of every category, indexed by the category code.
+    """
+    if year is not None:
+        if year not in limits:
+            raise ValueError(f'no limits for {year}, only for {", ".join(map(str, limits))}')
+        limits = limits[year]
+    if categories is None:
+        categories = list(expenditures.keys())
+    return {c : find_rank(limits[c], expenditures[c]) for c in categories}
+
+def load_cdf(file):
+    """
+    Loads the weighted CDF knots of every category.
+
+    Parameters
+    ----------
+    file : Path object
+        The .npz file created by data_creation.py.
+
+    Returns
+    -------
+    dict
+        The knot values and the CDF at every knot, indexed by the category code.
+    """
+    with np.load(file) as cdf:
+        x, p, offsets = cdf['x'], cdf['p'], cdf['offsets']
+        return {c : (x[start:end], p[start:end])
+                for c, start, end in zip(cdf['categories'], offsets[:-1], offsets[1:])}
+
+def continuous_percentile(knots, values):
+    """
+    Finds the continuous percentile of every value in an array of values.
+
+    Parameters
+    ----------
+    knots : tuple
+        The knot values and the CDF at every knot of a single category, as loaded by load_cdf.
+    values : array like or float
+        The per-person expenditures.
+
+    Returns
+    -------
+    numpy array or float
+        The percentile of every value, between 0 and 100.
+    """
+    x, p = knots
+    return 100 * np.interp(values, x, p, left=0.0, right=1.0)
@@ -0,0 +1,154 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It projects the limits of a survey year to the prices of later months, with consumer price indices,
+so expenditures in current prices are classified against limits in the same prices.
+
+It performs the following tasks:
+
+Library Imports:
+Imports csv and numpy only, the same as classifier.py.
+
+CPI File Format:
+A CSV file (data/cpi.csv by default) with a 'month' column, as YYYY-MM, and a column of the index of every
+category, named by the category code (c3, c30, ..., c39), with a row for every month:
+month,c3,c30,c31
+2022-01,100.0,100.0,100.0
+2022-02,100.3,100.6,99.1
+Every category is projected with its own column. Categories without a column are projected with the 'c3' column,
+the index of the whole consumption expenditure, which the general CPI of the Central Bureau of Statistics fits.
+The indices can have any base, since only their ratios are used. No CPI file is included in the project:
+it should be filled from the CPI publications of the Central Bureau of Statistics.
+
+Projection:
+The base of every category is the average of its index over the 12 months of the survey year, since the survey
+expenditures were collected over the whole year. The limits of a month are the survey limits times the ratio of
+the index of the month to the base. Multiplying by a positive number keeps the order of the limits,
+so the ranks of the projected limits are defined exactly as the ranks of the survey limits.
+
+Function Definitions:
+load_cpi(file): Loads the indices of every month and category.
+price_factors(cpi, month, base_year): Calculates the price ratio of every category between a month and a survey year.
+project_limits(limits, cpi, base_year, months=None): Projects the limits to every month in advance,
+so a lookup needs only the array search of find_rank.
+
+Usage:
+from cpi import load_cpi, project_limits
+projected = project_limits(load_limits('data/limits.csv'), load_cpi('data/cpi.csv'), 2022)
+decile = find_rank(projected['2024-05']['c3'], exp_pp)
+"""
+
+# Importing the required libraries.
+import csv
+import numpy as np
+
+# The category whose index is used for categories without an index of their own.
+GENERAL = 'c3'
+
+def load_cpi(file):
+    """
+    Loads the consumer price indices of every month and category.
+
+    Parameters
+    ----------
+    file : Path object or str
+        The CPI CSV file.
+
+    Raises
+    ------
+    ValueError
+        If the file has no 'month' column, or the months are not in order.
+
+    Returns
+    -------
+    dict
+        The months, as a list of 'YYYY-MM' strings, under 'month',
+        and the index of every month of every category, as an array under the category code.
+    """
+    with open(file, newline='') as f:
+        rows = list(csv.reader(f))
+    header = [c.strip().lower() for c in rows[0]]
+    if 'month' not in header:
+        raise ValueError(f"{file} has no 'month' column")
+    rows = [r for r in rows[1:] if r]
+    j = header.index('month')
+    months = [r[j].strip() for r in rows]
+    if months != sorted(months) or len(set(months)) != len(months):
+        raise ValueError(f'{file} must have every month once, in order')
+    cpi = {'month' : months}
+    for i, c in enumerate(header):
+        if i != j:
+            cpi[c] = np.array([float(r[i]) for r in rows])
+    return cpi
+
+def price_factors(cpi, month, base_year):
+    """
+    Calculates the price ratio of every category between a month and a survey year.
+
+    Parameters
+    ----------
+    cpi : dict
+        The indices, as loaded by load_cpi.
+    month : str
+        The month, as YYYY-MM.
+    base_year : int
+        The survey year.
+
+    Raises
+    ------
+    ValueError
+        If the file has no index of the month, or of all the months of the survey year.
+
+    Returns
+    -------
+    dict
+        The price ratio of every category with an index.
+    """
+    months = cpi['month']
+    if month not in months:
+        raise ValueError(f'no price indices of {month}')
+    base = [i for i, m in enumerate(months) if m.startswith(f'{base_year}-')]
+    if len(base) != 12:
+        raise ValueError(f'the price indices of all the 12 months of {base_year} are needed, found {len(base)}')
+    i = months.index(month)
+    return {c : float(index[i] / index[base].mean()) for c, index in cpi.items() if c != 'month'}
+
+def project_limits(limits, cpi, base_year, months=None):
+    """
+    Projects the limits of a survey year to the prices of every month.
+
+    Parameters
+    ----------
+    limits : dict
+        The limits of every category, as loaded by load_limits.
+    cpi : dict
+        The indices, as loaded by load_cpi.
+    base_year : int
+        The survey year of the limits.
+    months : list, optional
+        The months to project to. The default is None, for every month in cpi.
+
+    Raises
+    ------
+    ValueError
+        If a category has no index and there is no 'c3' index either.
+
+    Returns
+    -------
+    dict
+        The read-only limits of every category of every month, indexed by the month.
+    """
+    projected = {}
+    for month in (cpi['month'] if months is None else months):
+        factors = price_factors(cpi, month, base_year)
+        projected[month] = {}
+        for c, l in limits.items():
+            factor = factors.get(c, factors.get(GENERAL))
+            if factor is None:
+                raise ValueError(f"no price index of {c} and no '{GENERAL}' index")
+            values = np.asarray(l) * factor
+            values.flags.writeable = False
+            projected[month][c] = values
+    return projected
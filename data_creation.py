@@ -8,53 +8,755 @@ It calculate the limits of the different expenditure categories deciles.
 It performs the following tasks:
 
 Library Imports:
-Imports the necessary libraries: pandas for data manipulation, numpy for numerical operations, 
-and DescrStatsW from statsmodels for weighted descriptive statistics.
+Imports the necessary libraries: pandas for data manipulation, numpy for numerical operations,
+load_survey and survey_columns from ingestion.py for reading the survey, write_artifact from artifact.py for the binary limits,
+time and tracemalloc for profiling the stages,
+and weighted_quantiles, streaming_weighted_quantiles, bootstrap_weighted_quantiles and weighted_cdf_knots
+from quantiles.py for weighted quantiles.
+weighted_quantiles gives the same results as DescrStatsW from statsmodels, without depending on statsmodels.
 
 Data Loading:
-Reads a CSV file containing the 2022 Expenditure Survey data into a DataFrame named mbs.
-Converts all column names to lowercase for consistency.
+Reads the Expenditure Survey file given with --source (or the EXPENDITURE_SURVEY environment variable),
+a CSV or Parquet file, into a DataFrame named mbs with load_survey.
+Only the category columns, 'nefeshstandartit' and 'weight' are read, with lowercase names and the smallest
+lossless dtypes. The parsed survey is cached as Parquet (or Feather, with --cache-format) in the --cache folder,
+keyed by the hash of the survey file, so later runs on the same survey do not parse the CSV again.
 
 DataFrame Initialization:
 Initializes an empty DataFrame named results with an index corresponding to decile limits (from 0.1 to 0.9).
+With --grid, any other grid of quantiles is calculated, such as percentiles (--grid 100) or permilles (--grid 1000).
 
 Quantile Calculation:
-Calculates the quantiles for each category (columns 'c30' to 'c39') weighted by the 'weight' column, 
+Calculates the quantiles for each category (columns 'c30' to 'c39') weighted by the 'weight' column,
 and normalizes these values by dividing by 'nefeshstandartit' - an equivalence-scaled number of persons.
 
 Stores these quantile values in the results DataFrame.
+With --workers, the columns are sorted in parallel by a thread pool, or by a process pool with --executor process.
+
+Streaming Quantile Calculation:
+With --streaming, the survey is never loaded as a whole. Only the category columns, 'nefeshstandartit' and 'weight'
+are read, chunk by chunk, and the quantiles are calculated by streaming_weighted_quantiles,
+within --tolerance of the DescrStatsW result, unless a cumulative weight is so close to a limit's share of the total
+weight that DescrStatsW's own answer depends on how its sums round (see streaming_weighted_quantiles).
+
+Bootstrap Confidence Intervals:
+With --bootstrap, the limits are also calculated for the given number of Poisson bootstrap replicates of the survey,
+in batches spread across --workers. The lower and upper bounds of the 1 - alpha confidence interval of every limit
+are exported next to the limits.
+
+Weighted CDF Knots:
+Compresses the weighted empirical CDF of every category into up to --knots knots,
+used by exp_decile.py for continuous percentiles. Not available with --streaming.
 
 Upper Limit Adjustment:
 Adds an open upper limit for the 10th decile by setting the value for index 1.0 to be the value of the 9th decile (0.9) plus 1.
+For other grids, the value for index 1.0 is the value of the last quantile plus 1.
 
 Export Results:
-Exporting the results as a csv file.
+Exporting the results as a csv file, and the bootstrap bounds as limits_lower.csv and limits_upper.csv.
+Grids other than deciles are exported as limits_<grid>.csv, for example limits_100.csv.
+The CDF knots are exported as cdf.npz.
+The limits are also exported as a binary artifact (limits.npy and limits.json) that exp_decile.py memory-maps.
+
+Multi-Year Store:
+With --survey YEAR=FILE, given once for every survey year, the limits of every year are calculated,
+the years in parallel across --workers, and exported together as limits_years.csv (indexed by the year
+and the quantile) and as a multi-year binary artifact (limits_years.npy and limits_years.json),
+which exp_decile.py memory-maps to classify by any of the years.
+For other grids, they are exported as limits_<grid>_years.csv.
+
+Subgroup Limits:
+With --groups, the limits are also calculated for every group of households with the same values
+of the given survey columns (such as the number of persons, the district or the population group),
+all the groups at once with grouped_weighted_quantiles. They are exported as limits_groups.csv
+(indexed by the grouping columns and the quantile) and as a subgroup binary artifact
+(limits_groups.npy and limits_groups.json), indexed by group, category and quantile,
+which is queried by the group key in constant time. For other grids, they are exported as limits_<grid>_groups.
+
+Incremental Limits:
+With --incremental, the survey is kept sorted by the per-person expenditure of every category in --state
+(see incremental.py). The first run builds the state from --source. Later runs with --update apply a file
+of corrected or supplemental households (by 'misparmb') to the state without sorting the survey again,
+and limits.csv and its binary artifact are rewritten only when at least one limit moved.
+The CDF knots are not exported in this mode.
+
+Stages and Profiling:
+The run is split into stages: read, normalize (by 'nefeshstandartit'), quantile, upper_limit and export,
+and bootstrap, cdf and groups when they are asked for (streaming_quantile, years or incremental in the other modes).
+The survey is normalized once, and the quantile, bootstrap, cdf and groups stages all use the same
+per-person expenditures. With --profile, every stage is timed (wall and CPU seconds) and the run report is written as JSON, with the command,
+the versions, the number of survey rows and every stage, so it shows whether parsing the survey or sorting
+the quantiles dominates as the survey grows. With --profile-memory, the peak memory of every stage above the memory
+held before it is recorded as well, with tracemalloc. Without --profile the stages are not timed at all.
+
+Usage:
+python data_creation.py --source H20221021datamb.csv
+python data_creation.py --source H20221021datamb.csv --workers 4
+python data_creation.py --source H20221021datamb.csv --profile reports/run.json --profile-memory
+python data_creation.py --source H20221021datamb.csv --grid 100
+python data_creation.py --source H20221021datamb.csv --groups nefesh
+python data_creation.py --source H20221021datamb.csv --incremental
+python data_creation.py --incremental --update corrected_weights.csv
+python data_creation.py --source H20221021datamb.csv --bootstrap 10000 --workers 8
+python data_creation.py --source H20221021datamb.csv --streaming --tolerance 0.01 --chunksize 500000
+python data_creation.py --survey 2021=H20211021datamb.csv --survey 2022=H20221021datamb.csv --workers 2
 """
 
 # Importing the required libraries.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
 import pandas as pd
 import numpy as np
-from statsmodels.stats.weightstats import DescrStatsW as dsw
+from datetime import datetime, timezone
 from pathlib import Path
+from artifact import write_artifact, write_store, write_groups
+from ingestion import load_survey, survey_columns, file_columns
+from incremental import build_state, save_state, load_state, update_state, state_limits
+from quantiles import quantile_grid, parallel_map, weighted_quantiles, grouped_weighted_quantiles, streaming_weighted_quantiles, bootstrap_weighted_quantiles, weighted_cdf_knots
+
+# The default Expenditure Survey file, which can be given with the EXPENDITURE_SURVEY environment variable.
+SURVEY = os.environ.get('EXPENDITURE_SURVEY')
+
+# The default cache folder of the parsed survey.
+CACHE = Path('./cache')
+
+# The default sorted state of --incremental.
+STATE = CACHE / 'state.npz'
+
+# The decile limits to calculate by default.
+PROBS = quantile_grid(10)
+
+def category_columns(file):
+    """
+    Finds the expenditure category columns of the survey, from 'c3' to 'c39'.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+
+    Returns
+    -------
+    list
+        The lowercase names of the category columns.
+    """
+    columns = [c.lower() for c in survey_columns(file)]
+    return columns[columns.index('c3') : columns.index('c39') + 1]
+
+def read_survey(file, cache=CACHE, fmt='parquet', extra=()):
+    """
+    Reads the category columns, 'nefeshstandartit' and 'weight' of the survey, with lowercase column names.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+    cache : Path object, optional
+        The cache folder of the parsed survey. None reads the survey without a cache. The default is CACHE.
+    fmt : str, optional
+        The cache file format, 'parquet' or 'feather'. The default is 'parquet'.
+    extra : list, optional
+        Other columns to read, such as the grouping columns. The default is ().
+
+    Returns
+    -------
+    DataFrame
+        The survey.
+    """
+    columns = None
+    if extra:
+        columns = category_columns(file) + ['nefeshstandartit', 'weight'] + [c.lower() for c in extra]
+    return load_survey(file, columns, cache, fmt)
+
+def survey_chunks(file, categories, chunksize):
+    """
+    Reads the survey chunk by chunk, reading only the category columns, 'nefeshstandartit' and 'weight'.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+    categories : list
+        The lowercase names of the category columns.
+    chunksize : int
+        The number of rows in every chunk.
+
+    Yields
+    ------
+    tuple
+        The per-person expenditures of every category as a 2-D array, and the weights.
+    """
+    wanted = set(categories) | {'nefeshstandartit', 'weight'}
+    if file.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        names = survey_columns(file, wanted)
+        chunks = (b.to_pandas() for b in pq.ParquetFile(file).iter_batches(batch_size=chunksize, columns=names))
+    else:
+        chunks = pd.read_csv(file, usecols=lambda c: c.lower() in wanted, chunksize=chunksize)
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.lower()
+        values = chunk[categories].to_numpy(dtype=float) / chunk['nefeshstandartit'].to_numpy(dtype=float)[:, None]
+        yield values, chunk['weight'].to_numpy(dtype=float)
+
+def per_person_expenditures(mbs):
+    """
+    Divides the expenditure of every category by the standardized number of persons.
+
+    Parameters
+    ----------
+    mbs : DataFrame
+        The survey.
+
+    Returns
+    -------
+    tuple
+        The per-person expenditures (rows, categories), the names of the categories and the weights.
+    """
+    categories = mbs.loc[:, 'c3' : 'c39']
+    values = categories.to_numpy(dtype=float) / mbs['nefeshstandartit'].to_numpy(dtype=float)[:, None]
+    return values, categories.columns, mbs['weight'].to_numpy(dtype=float)
+
+def exact_limits(mbs, probs=PROBS, workers=1, executor='thread'):
+    """
+    Calculates the limits of each category with weighted_quantiles.
+
+    Parameters
+    ----------
+    mbs : DataFrame
+        The survey.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    workers : int, optional
+        The number of workers calculating the categories in parallel. The default is 1.
+    executor : str, optional
+        'thread' or 'process'. The default is 'thread'.
+
+    Returns
+    -------
+    DataFrame
+        The limits, indexed by the quantiles, with a column for every category.
+    """
+    return quantile_limits(*per_person_expenditures(mbs), probs, workers, executor)
+
+def quantile_limits(values, categories, weights, probs=PROBS, workers=1, executor='thread'):
+    """
+    Calculates the limits of each category from the per-person expenditures with weighted_quantiles.
+
+    Parameters
+    ----------
+    values : numpy array
+        The per-person expenditures (rows, categories).
+    categories : list
+        The names of the categories.
+    weights : numpy array
+        The weights.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    workers : int, optional
+        The number of workers calculating the categories in parallel. The default is 1.
+    executor : str, optional
+        'thread' or 'process'. The default is 'thread'.
+
+    Returns
+    -------
+    DataFrame
+        The limits, indexed by the quantiles, with a column for every category.
+    """
+    return pd.DataFrame(weighted_quantiles(values, weights, probs, workers, executor),
+                        index=pd.Index(probs, name='p'),
+                        columns=categories)
+
+def group_limits(mbs, columns, probs=PROBS, expenditures=None):
+    """
+    Calculates the limits of each category within every group of households, all the groups at once.
+
+    Parameters
+    ----------
+    mbs : DataFrame
+        The survey.
+    columns : list
+        The lowercase names of the columns to group the households by.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    expenditures : tuple, optional
+        The per-person expenditures, the names of the categories and the weights of the survey,
+        as returned by per_person_expenditures. The default is None, which calculates them from mbs.
+
+    Returns
+    -------
+    tuple
+        The limits (groups, quantiles, categories), the key of every group as a tuple
+        of the values of the grouping columns, and the names of the categories.
+        Households with a missing grouping value are left out.
+    """
+    grouped = mbs.groupby(list(columns), sort=True)
+    codes = grouped.ngroup().to_numpy()
+    keys = [k if isinstance(k, tuple) else (k,) for k in grouped.size().index.tolist()]
+    values, categories, weights = expenditures or per_person_expenditures(mbs)
+    grouped_rows = codes >= 0
+    limits = grouped_weighted_quantiles(values[grouped_rows], weights[grouped_rows], codes[grouped_rows], probs, len(keys))
+    return limits, keys, categories
+
+def export_groups(limits, keys, columns, probs, categories, file):
+    """
+    Adds the open upper limit to the limits of every group and exports them.
+
+    Parameters
+    ----------
+    limits : numpy array
+        The limits (groups, quantiles, categories).
+    keys : list
+        The key of every group.
+    columns : list
+        The names of the grouping columns.
+    probs : numpy array
+        The quantiles.
+    categories : list
+        The names of the categories.
+    file : Path object
+        The file name without a suffix. The .csv, .npy and .json suffixes are added.
+    """
+    limits = np.concatenate([limits, limits[:, -1:, :] + 1], axis=1)
+    probs = np.append(probs, 1.0)
+    index = pd.MultiIndex.from_tuples([k + (p,) for k in keys for p in probs], names=list(columns) + ['p'])
+    pd.DataFrame(limits.reshape(-1, len(categories)), index=index, columns=categories).to_csv(file.with_suffix('.csv'))
+    write_groups(file, limits, columns, keys, probs, categories)
+
+def bootstrap_limits(mbs, replicates, alpha, seed, batch, probs=PROBS, workers=1, executor='thread', expenditures=None):
+    """
+    Calculates bootstrap confidence intervals of the limits of each category.
+
+    Parameters
+    ----------
+    mbs : DataFrame
+        The survey.
+    replicates : int
+        The number of bootstrap replicates.
+    alpha : float
+        The confidence intervals are of 1 - alpha.
+    seed : int
+        The random seed.
+    batch : int
+        The number of replicates calculated together.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    workers : int, optional
+        The number of workers calculating batches in parallel. The default is 1.
+    executor : str, optional
+        'thread' or 'process'. The default is 'thread'.
+    expenditures : tuple, optional
+        The per-person expenditures, the names of the categories and the weights of the survey,
+        as returned by per_person_expenditures. The default is None, which calculates them from mbs.
+
+    Returns
+    -------
+    tuple
+        The lower and upper bounds DataFrames, indexed by the quantiles, with a column for every category.
+    """
+    values, categories, weights = expenditures or per_person_expenditures(mbs)
+    bounds = bootstrap_weighted_quantiles(values, weights, probs,
+                                          replicates=replicates,
+                                          batch=batch,
+                                          alpha=alpha,
+                                          seed=seed,
+                                          workers=workers,
+                                          executor=executor)
+    return tuple(pd.DataFrame(b, index=pd.Index(probs, name='p'), columns=categories) for b in bounds)
+
+def export_cdf(mbs, knots, file, expenditures=None):
+    """
+    Calculates the weighted CDF knots of each category and exports them.
+
+    Parameters
+    ----------
+    mbs : DataFrame
+        The survey.
+    knots : int
+        The largest number of knots of every category.
+    file : Path object
+        The .npz file to export to.
+    expenditures : tuple, optional
+        The per-person expenditures, the names of the categories and the weights of the survey,
+        as returned by per_person_expenditures. The default is None, which calculates them from mbs.
+    """
+    values, categories, weights = expenditures or per_person_expenditures(mbs)
+    tables = weighted_cdf_knots(values, weights, knots)
+    np.savez(file,
+             categories=np.array(categories, dtype=str),
+             x=np.concatenate([x for x, p in tables]),
+             p=np.concatenate([p for x, p in tables]),
+             offsets=np.cumsum([0] + [len(x) for x, p in tables]))
+
+def streaming_limits(file, tolerance, chunksize, probs=PROBS):
+    """
+    Calculates the limits of each category without loading the whole survey.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+    tolerance : float
+        The largest allowed distance from the DescrStatsW limits.
+    chunksize : int
+        The number of rows to read at a time.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+
+    Returns
+    -------
+    DataFrame
+        The limits, indexed by the quantiles, with a column for every category.
+    """
+    categories = category_columns(file)
+    values = streaming_weighted_quantiles(lambda: survey_chunks(file, categories, chunksize),
+                                          probs,
+                                          tolerance=tolerance)
+    return pd.DataFrame(values, index=pd.Index(probs, name='p'), columns=categories)
+
+def survey_year(text):
+    """
+    Parses a --survey argument.
+
+    Parameters
+    ----------
+    text : str
+        The survey year and file, as YEAR=FILE.
+
+    Returns
+    -------
+    tuple
+        The year and the survey file.
+    """
+    year, sep, file = text.partition('=')
+    if not sep or not year.isdigit():
+        raise argparse.ArgumentTypeError(f'{text!r} is not YEAR=FILE')
+    return int(year), Path(file)
+
+def _year_limits(job):
+    """
+    Calculates the limits of a single survey year.
+
+    Parameters
+    ----------
+    job : tuple
+        The survey file, the quantiles, the cache folder and the cache file format.
+
+    Returns
+    -------
+    DataFrame
+        The limits, with the open upper limit.
+    """
+    file, probs, cache, fmt = job
+    limits = exact_limits(read_survey(file, cache, fmt), probs)
+    limits.loc[1.0, :] = limits.loc[probs[-1], :] + 1
+    return limits
+
+def year_limits(surveys, probs=PROBS, cache=CACHE, fmt='parquet', workers=1, executor='thread'):
+    """
+    Calculates the limits of several survey years, the years in parallel.
+
+    Parameters
+    ----------
+    surveys : dict
+        The survey file of every year.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    cache : Path object, optional
+        The cache folder of the parsed surveys. None reads the surveys without a cache. The default is CACHE.
+    fmt : str, optional
+        The cache file format, 'parquet' or 'feather'. The default is 'parquet'.
+    workers : int, optional
+        The number of workers calculating years in parallel. The default is 1.
+    executor : str, optional
+        'thread' or 'process'. The default is 'thread'.
+
+    Raises
+    ------
+    ValueError
+        If the years do not have the same categories.
+
+    Returns
+    -------
+    dict
+        The limits of every year, with the open upper limit.
+    """
+    years = sorted(surveys)
+    limits = dict(zip(years, parallel_map(_year_limits, [(surveys[y], probs, cache, fmt) for y in years], workers, executor)))
+    categories = limits[years[0]].columns
+    for y in years:
+        if not limits[y].columns.equals(categories):
+            raise ValueError(f'the {y} survey has other categories than the {years[0]} survey')
+    return limits
+
+def incremental_limits(source, update, state_file, probs=PROBS, cache=CACHE, fmt='parquet'):
+    """
+    Calculates the limits from the sorted state, building it from the survey or updating it.
+
+    Parameters
+    ----------
+    source : Path object
+        The survey CSV or Parquet file, read when there is no update.
+    update : Path object
+        A CSV or Parquet file of corrected or supplemental households, with 'misparmb' and any of the category
+        columns, 'nefeshstandartit' and 'weight'. None builds the state from the survey.
+    state_file : Path object
+        The sorted state file.
+    probs : numpy array, optional
+        The quantiles to calculate. The default is PROBS, the deciles.
+    cache : Path object, optional
+        The cache folder of the parsed survey. The default is CACHE.
+    fmt : str, optional
+        The cache file format, 'parquet' or 'feather'. The default is 'parquet'.
+
+    Returns
+    -------
+    DataFrame
+        The limits, indexed by the quantiles, with a column for every category.
+    """
+    if update is None:
+        mbs = read_survey(source, cache, fmt, ['misparmb'])
+        values, categories, weights = per_person_expenditures(mbs)
+        state = build_state(mbs['misparmb'].to_numpy(),
+                            mbs.loc[:, 'c3' : 'c39'].to_numpy(dtype=float),
+                            mbs['nefeshstandartit'].to_numpy(dtype=float),
+                            weights,
+                            categories)
+    else:
+        state = load_state(state_file)
+        known = set(state['categories']) | {'misparmb', 'nefeshstandartit', 'weight'}
+        columns = [c.lower() for c in file_columns(update) if c.lower() in known]
+        changes = load_survey(update, columns)
+        state, updated, appended = update_state(state,
+                                                changes['misparmb'].to_numpy(),
+                                                {c : changes[c].to_numpy(dtype=float) for c in changes if c != 'misparmb'})
+        print(f'Updated {updated} households and appended {appended} households')
+    save_state(state, state_file)
+    return pd.DataFrame(state_limits(state, probs), index=pd.Index(probs, name='p'), columns=list(state['categories']))
+
+@contextlib.contextmanager
+def stage(report, name):
+    """
+    Times a stage of the run, and records its peak memory if tracemalloc is tracing.
+
+    Parameters
+    ----------
+    report : dict
+        The run report, which the stage is added to. None does not time the stage.
+    name : str
+        The name of the stage.
+    """
+    if report is None:
+        yield
+        return
+    memory = tracemalloc.is_tracing()
+    if memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        entry = {'name' : name,
+                 'seconds' : time.perf_counter() - start,
+                 'cpu_seconds' : time.process_time() - cpu}
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The memory held before the stage is not counted, so the stages can be compared.
+            entry['peak_bytes'] = peak - before
+            entry['retained_bytes'] = current - before
+        report['stages'].append(entry)
+
+def write_report(report, file):
+    """
+    Prints the stages of the run report and writes it as JSON.
+
+    Parameters
+    ----------
+    report : dict
+        The run report.
+    file : Path object
+        The JSON file. Overwritten if it already exists.
+    """
+    total = report['seconds']
+    print(f"{'stage':>20} {'seconds':>10} {'share':>7} {'peak memory':>12}")
+    for entry in report['stages']:
+        peak = f"{entry['peak_bytes'] / 2 ** 20:>10.1f}MB" if 'peak_bytes' in entry else f"{'-':>12}"
+        print(f"{entry['name']:>20} {entry['seconds']:>9.3f}s {entry['seconds'] / total:>7.1%} {peak}")
+    print(f"{'total':>20} {total:>9.3f}s")
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(json.dumps(report, indent=1))
+    print(f'Run report written to {file}')
+
+def create_limits(args, report=None):
+    """
+    Calculates and exports the limits, stage by stage.
+
+    Parameters
+    ----------
+    args : Namespace
+        The parsed command line arguments.
+    report : dict, optional
+        The run report, which every stage is added to. The default is None, which does not profile the stages.
+    """
+    path = Path('./data')
+    cache = None if args.no_cache else args.cache
+
+    if args.survey:
+        # Calculating the limits of every year and exporting them to the multi-year store.
+        surveys = dict(args.survey)
+        with stage(report, 'years'):
+            limits = year_limits(surveys, quantile_grid(args.grid), cache, args.cache_format, args.workers or None, args.executor)
+        with stage(report, 'export'):
+            stem = 'limits_years' if args.grid == 10 else f'limits_{args.grid}_years'
+            pd.concat(limits, names=['year']).to_csv(path / f'{stem}.csv')
+            first = limits[min(limits)]
+            write_store(path / stem, limits, first.index, first.columns)
+        return
+
+    # Creating an empty DataFrame to contain the results of the deciles limits.
+    probs = quantile_grid(args.grid)
+    results = {'limits' : pd.DataFrame(index=probs)}
+
+    if args.incremental:
+        # Updating the sorted state, and exporting the limits only if at least one of them moved.
+        with stage(report, 'incremental'):
+            limits = incremental_limits(args.source, args.update, args.state, probs, cache, args.cache_format)
+        with stage(report, 'upper_limit'):
+            limits.loc[1.0, :] = limits.loc[probs[-1], :] + 1
+        with stage(report, 'export'):
+            stem = 'limits' if args.grid == 10 else f'limits_{args.grid}'
+            file = path / f'{stem}.csv'
+            if file.exists():
+                current = pd.read_csv(file, index_col='p', float_precision='round_trip')
+                if current.index.equals(limits.index) and current.columns.equals(limits.columns) and np.array_equal(current.to_numpy(), limits.to_numpy(), equal_nan=True):
+                    print(f'No limit moved, {file} was not rewritten')
+                    return
+            limits.to_csv(file)
+            write_artifact(path / stem, limits, limits.index, limits.columns, file)
+            print(f'The limits moved, {file} was rewritten')
+        return
 
-# Importing the 2022 Expenditure Survey and making the column names lowercase.
-mbs = pd.read_csv(r"C:\Backup\CBS Households Expenditures Survey\famexp_2022\H20221021datamb.csv")
-mbs.columns = mbs.columns.str.lower()
+    # Calculating the limits of each category.
+    if args.streaming:
+        # Reading, normalizing and calculating are interleaved chunk by chunk, so they are a single stage.
+        with stage(report, 'streaming_quantile'):
+            results['limits'] = streaming_limits(args.source, args.tolerance, args.chunksize, probs)
+    else:
+        # Importing the Expenditure Survey, from the cache if it was already parsed.
+        with stage(report, 'read'):
+            mbs = read_survey(args.source, cache, args.cache_format, args.groups or ())
+        if report is not None:
+            report['rows'] = len(mbs)
+        with stage(report, 'normalize'):
+            values, categories, weights = per_person_expenditures(mbs)
+        with stage(report, 'quantile'):
+            results['limits'] = quantile_limits(values, categories, weights, probs, args.workers or None, args.executor)
+        if args.bootstrap:
+            with stage(report, 'bootstrap'):
+                results['lower'], results['upper'] = bootstrap_limits(mbs,
+                                                                      args.bootstrap,
+                                                                      args.alpha,
+                                                                      args.seed,
+                                                                      args.batch,
+                                                                      probs,
+                                                                      args.workers or None,
+                                                                      args.executor,
+                                                                      (values, categories, weights))
 
-# Creating an empty DataFrame to contain the results of the deciles limits.
-results = {'limits' : pd.DataFrame(index=np.round(np.arange(0.1,1,step=0.1), 1))}
+    # Creating an open upper limit of the 5th.
+    with stage(report, 'upper_limit'):
+        for key in results:
+            results[key].loc[1.0, :] = results[key].loc[probs[-1], :] + 1
 
-# Calculating the limits of each category.
-results['limits'] = dsw(mbs.loc[:, 'c3' : 'c39'].div(mbs['nefeshstandartit'], axis=0), 
-                        mbs['weight']).quantile(np.round(np.arange(0.1,1,step=0.1), 1))
+    # Exporting the results to the "data" folder.
+    if args.knots and not args.streaming:
+        with stage(report, 'cdf'):
+            export_cdf(mbs, args.knots, path / 'cdf.npz', (values, categories, weights))
+    stem = 'limits' if args.grid == 10 else f'limits_{args.grid}'
+    if args.groups:
+        with stage(report, 'groups'):
+            columns = [c.lower() for c in args.groups]
+            limits, keys, group_categories = group_limits(mbs, columns, probs, (values, categories, weights))
+            export_groups(limits, keys, columns, probs, group_categories, path / f'{stem}_groups')
+    with stage(report, 'export'):
+        for key in results:
+            file_name = f'{stem}.csv' if key == 'limits' else f'{stem}_{key}.csv'
+            results[key].to_csv(path / file_name)
+        write_artifact(path / stem, results['limits'], results['limits'].index, results['limits'].columns, path / f'{stem}.csv')
 
-# Renaming the columns.
-results['limits'].columns = mbs.loc[:, 'c3' : 'c39'].columns
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calculates the limits of the expenditure categories deciles.')
+    parser.add_argument('--source', type=Path, default=SURVEY, help='The Expenditure Survey CSV or Parquet file. The default is the EXPENDITURE_SURVEY environment variable.')
+    parser.add_argument('--survey', type=survey_year, action='append', metavar='YEAR=FILE', help='The survey file of a year, for the multi-year store. Given once for every year.')
+    parser.add_argument('--cache', type=Path, default=CACHE, help='The cache folder of the parsed survey.')
+    parser.add_argument('--cache-format', choices=['parquet', 'feather'], default='parquet', help='The file format of the cached survey.')
+    parser.add_argument('--no-cache', action='store_true', help='Parse the survey without reading or writing the cache.')
+    parser.add_argument('--groups', nargs='+', metavar='COLUMN', help='Also calculate the limits of every group of households with the same values of these survey columns.')
+    parser.add_argument('--incremental', action='store_true', help='Keep the survey sorted in --state, and rewrite the limits only when they move.')
+    parser.add_argument('--state', type=Path, default=STATE, help='The sorted state file of --incremental.')
+    parser.add_argument('--update', type=Path, help='A file of corrected or supplemental households, by misparmb, to apply to the state.')
+    parser.add_argument('--grid', type=int, default=10, help='The number of quantile groups: 10 for deciles, 100 for percentiles, 1000 for permilles.')
+    parser.add_argument('--knots', type=int, default=1000, help='The largest number of CDF knots of every category. 0 skips the CDF.')
+    parser.add_argument('--workers', type=int, default=1, help='The number of workers calculating the categories in parallel. 0 means the number of CPUs.')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread', help='Run the workers as threads or as processes.')
+    parser.add_argument('--bootstrap', type=int, default=0, help='The number of bootstrap replicates for confidence intervals of the limits.')
+    parser.add_argument('--alpha', type=float, default=0.05, help='The bootstrap confidence intervals are of 1 - alpha.')
+    parser.add_argument('--batch', type=int, default=100, help='The number of bootstrap replicates calculated together.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed of the bootstrap.')
+    parser.add_argument('--streaming', action='store_true', help='Read the survey in chunks instead of loading it as a whole.')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='The largest allowed distance of a streaming limit from the exact limit, except where a cumulative weight is within 1e-12 of the total weight of a limit (see quantiles.STREAM_HIT).')
+    parser.add_argument('--chunksize', type=int, default=500_000, help='The number of rows to read at a time in streaming mode.')
+    parser.add_argument('--profile', type=Path, help='Time every stage of the run, and write the run report to this JSON file.')
+    parser.add_argument('--profile-memory', action='store_true', help='Also record the peak memory of every stage with tracemalloc, which slows the run.')
+    args = parser.parse_args(argv)
+    if args.streaming and args.bootstrap:
+        parser.error('--bootstrap needs the whole survey and cannot be used with --streaming')
+    if args.survey and (args.streaming or args.bootstrap or args.groups):
+        parser.error('--survey cannot be used with --streaming, --bootstrap or --groups')
+    years = [year for year, file in args.survey or []]
+    if len(set(years)) != len(years):
+        parser.error(f'--survey was given more than once for the years {sorted({y for y in years if years.count(y) > 1})}')
+    if args.streaming and args.groups:
+        parser.error('--groups needs the whole survey and cannot be used with --streaming')
+    if args.incremental and (args.survey or args.streaming or args.bootstrap or args.groups):
+        parser.error('--incremental cannot be used with --survey, --streaming, --bootstrap or --groups')
+    if args.update and not args.incremental:
+        parser.error('--update needs --incremental')
+    if args.update and not args.state.exists():
+        parser.error(f'there is no state in {args.state}, run --incremental without --update first')
+    if args.profile_memory and not args.profile:
+        parser.error('--profile-memory needs --profile')
+    if not args.survey and args.source is None and not args.update:
+        parser.error('the survey file must be given with --source, --survey or the EXPENDITURE_SURVEY environment variable')
 
-# Creating an open upper limit of the 5th.    
-results['limits'].loc[1.0, :] = results['limits'].loc[0.9, :] + 1   
+    # Creating the run report, if the stages are profiled.
+    report = None
+    if args.profile:
+        report = {'command' : ['data_creation.py'] + list(sys.argv[1:] if argv is None else argv),
+                  'started' : datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                  'python' : platform.python_version(),
+                  'numpy' : np.__version__,
+                  'pandas' : pd.__version__,
+                  'memory' : args.profile_memory,
+                  'stages' : []}
+        if args.profile_memory:
+            tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        create_limits(args, report)
+    finally:
+        if report is not None:
+            report['seconds'] = time.perf_counter() - start
+            write_report(report, args.profile)
+            if args.profile_memory:
+                tracemalloc.stop()
 
-# Exporting the results to the "data" folder.
-path = Path('./data')
-file_name = 'limits.csv'
-results['limits'].to_csv(path / file_name)
+if __name__ == '__main__':
+    main()
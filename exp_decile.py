@@ -4,27 +4,55 @@ If you have any questions, send an email to dtsj89@gmail.com
 
 This script is part of the Expenditure Decile Calculator Project.
 This script sets up a Streamlit web application to calculate the expenditure decile for households based on their monthly expenditures. 
-It uses the pandas, numpy, streamlit, and pathlib libraries, and incorporates social media icons via st_social_media_links.
+It uses the streamlit and pathlib libraries and classifier.py, which needs numpy only, and incorporates social media icons via st_social_media_links.
 
 Script Overview
 
 Library Imports:
-Imports the necessary libraries for data manipulation (pandas), numerical operations (numpy), web application framework (streamlit), and path management (pathlib).
+Imports the necessary libraries for web application framework (streamlit), and path management (pathlib).
+The limits are plain numpy arrays, so pandas is not needed.
 Imports SocialMediaIcons for displaying social media links in the app.
+Imports load_limits, load_years, load_subgroups, nefesh_btl and find_rank from classifier.py for loading the limits, the standardized number of persons and for finding the decile of an expenditure.
+Imports load_cpi and project_limits from cpi.py for projecting the limits to current prices.
 
 Page Configuration:
 Sets the Streamlit page layout to wide.
 
 Function Definitions:
-nefesh_btl(nefesh): Calculates the standardized number of persons in the household based on definitions from the National Security Institute and the Central Bureau of Statistics.
-find_nearest(array, value): Finds the closest value in an array to the given value.
-load_data(file, p, i=None): Loads data from a CSV file, leveraging Streamlit's caching mechanism for efficiency.
+load_data(file, p): Loads limits data from the binary artifact if it matches the CSV file and from the CSV file otherwise, leveraging Streamlit's caching mechanism for efficiency.
+The limits are read-only arrays held once by the process and shared by all the sessions, instead of a copy for every session
+(see benchmarks/bench_memory.py).
+load_years_data(file, p): Loads the limits of every survey year from the multi-year store, once for all the sessions.
+load_groups_data(file, p): Loads the limits of every group of households from the subgroup store, once for all the sessions.
+rank_cache(): Creates the cache of the ranks, shared by all the sessions.
+cached_rank(limits, persons, category, amount, rank=find_rank): Finds the rank of an expenditure once for every
+limits, number of persons, category and amount, and takes it from the cache afterwards.
+calculator(data, percentiles, year): The inputs and results of the calculator, as a Streamlit fragment.
+load_projected(_limits, name, year, version): Projects limits to the prices of every month of the CPI file, once for every
+limits, survey year and version of the CPI file, so a rerun only searches the arrays of the latest month.
+A malformed CPI file is cached too, as its error message, so it is not parsed again on every rerun.
+
+Metrics:
+If the EXPENDITURE_METRICS environment variable is set, load_data, nefesh_btl, find_rank, percentile_rank,
+cached_rank, the calculator and the rendering of the deciles are timed with metrics.py, and the histograms are
+written to EXPENDITURE_METRICS_FILE in the Prometheus text format. Otherwise the functions run without any timing.
 
 Data Loading:
-Sets the path to the data directory and loads the decile limits data from a CSV file.
+Sets the path to the data directory and loads the decile limits data with load_limits, memory-mapping the binary artifact
+(limits.npy) if it matches limits.csv, and parsing limits.csv otherwise.
+Loads the percentile limits data as well, if data_creation.py created it, and displays the total expenditure percentile.
+If data_creation.py --survey created a multi-year store, the user can choose the survey year, and the deciles are found
+with the limits of that year, without loading any file again. The survey year is shown in the explanations tab.
+If data_creation.py --groups nefesh created the limits of every household size, the user can compare the household
+with households of the same size, looking the limits up by the household size in constant time.
+If data/cpi.csv exists (see cpi.py for its format), the limits are projected to the prices of its latest month,
+since the users enter expenditures in current prices.
+If the file does not have all the months of the survey year, the limits stay in the prices of the survey year.
+If the file is malformed, the limits stay in those prices too, with a single warning to the user on every run of the app
+(and none on the reruns of the calculator alone).
 
 Custom CSS for RTL Alignment:
-Adds custom CSS to ensure the text in the app is right-aligned, suitable for languages that use right-to-left scripts.
+Adds custom CSS, in a single style block, to ensure the text in the app is right-aligned, suitable for languages that use right-to-left scripts.
 
 Main Title:
 Displays the main title of the app in the center of the page.
@@ -36,10 +64,13 @@ Tabs Creation:
 Creates two tabs: "הסברים" (Explanations) and "מחשבון עשירוני הוצאה" (Expenditure Decile Calculator).
 Expenditure Decile Calculator Tab:
 
+The calculator is a fragment: a change of its inputs reruns only the calculator, and not the styles,
+the explanations tab or the social media links.
 Prompts the user to input the number of persons in the household.
 Allows the user to select between total expenditure and expenditure by category.
 Depending on the selection, prompts the user to input their monthly expenditures.
-Calculates the expenditure per person and determines the corresponding decile.
+Calculates the expenditure per person and determines the corresponding decile with find_rank from classifier.py,
+once for every number of persons, category and amount, in a cache shared by all the sessions.
 Displays the decile result.
 
 Explanations Tab:
@@ -50,119 +81,231 @@ Adds social media links and icons at the bottom of the app for user interaction.
 """
 
 # Importing the required libraries.
-import pandas as pd
-import numpy as np
 import streamlit as st
 from pathlib import Path
 from st_social_media_links import SocialMediaIcons
+from classifier import load_limits, load_years, load_subgroups, nefesh_btl, find_rank, percentile_rank
+from cpi import load_cpi, project_limits
+from metrics import timed, timer, flush
+
+# Timing the lookups, if the metrics are enabled with the EXPENDITURE_METRICS environment variable.
+nefesh_btl = timed('nefesh_btl')(nefesh_btl)
+find_rank = timed('find_rank')(find_rank)
+percentile_rank = timed('percentile_rank')(percentile_rank)
 
 # Set the Streamlit page configuration to wide layout.
 st.set_page_config(layout="wide")
 
-def nefesh_btl(nefesh):
+@timed('load_data')
+@st.cache_resource
+def load_data(file, p):
     """
-    Calculates the standardized number of persons in the household.
+    Loads limits data, memory-mapping the binary artifact created by data_creation.py if it matches the CSV file,
+    and reading the CSV file otherwise. The data is loaded once and shared by all the sessions,
+    as read-only arrays, so no session can change the limits of another.
 
     Parameters
     ----------
-    nefesh : int
-        The number of persons the household has.
+    file : str
+        The file name, without a suffix.
+    p : Path object
+        The path to the file.
 
     Returns
     -------
-    Float
-        The standardized number of persons in the household, 
-        according to National Security Institute and the Central Bureau of Statistics definition.
+    dict
+        The limits of every category, indexed by the category code.
     """
-    l = [1.25, 2, 2.65, 3.2, 3.75, 4.25, 4.75, 5.2]
-    if nefesh <= len(l) - 1:
-        return l[int(nefesh - 1)]
-    else:
-        return 5.6 + (nefesh - 9) * 0.4
+    return load_limits(p / (file + ".csv"))
 
-def find_nearest(array, value):
+@st.cache_resource
+def load_years_data(file, p):
     """
-    Finds the closest value in the array to the given value.
+    Loads the limits of every survey year, memory-mapping the multi-year store created by data_creation.py --survey.
+    The data is loaded once and shared by all the sessions.
 
     Parameters
     ----------
-    array : numpy array
-        The array to be searched.
-    value : float or int
-        A number to be searched in the array.
+    file : str
+        The file name, without a suffix.
+    p : Path object
+        The path to the file.
 
     Returns
     -------
-    int or float
-        Returns the closest value in the array to the value searched, from the bottom.
+    dict
+        The limits of every year, each a dict of the limits of every category.
     """
-    array = np.asarray(array)
-    if value < array[0]:
-        return array[0]
-    elif value >= array[-1]:
-        return array[-1]
-    array = array[array > value]
-    idx = (np.abs(array - value)).argmin()
-    return array[idx]
-
-@st.cache_data
-def load_data(file, p, i=None):
+    return load_years(p / (file + ".npy"))
+
+@st.cache_resource
+def load_groups_data(file, p):
     """
-    Loads data from a CSV file.
+    Loads the limits of every group of households, memory-mapping the subgroup store created by data_creation.py --groups.
+    The data is loaded once and shared by all the sessions.
 
     Parameters
     ----------
     file : str
-        The file name.
+        The file name, without a suffix.
     p : Path object
         The path to the file.
-    i : str, optional
-        The column to read as the index of the dataframe. The default is None.
 
     Returns
     -------
-    DataFrame
-        The loaded dataframe.
+    tuple
+        The limits of every group, indexed by the group key, and the names of the grouping columns.
+    """
+    return load_subgroups(p / (file + ".npy"))
+
+@st.cache_resource
+def load_projected(_limits, name, year, version):
+    """
+    Projects limits to the prices of every month of the CPI file. The projection is calculated once for every
+    limits, survey year and version of the CPI file, and shared by all the sessions and reruns.
+
+    Parameters
+    ----------
+    _limits : dict
+        The limits of every category. Not hashed by Streamlit, so name identifies them.
+    name : str
+        The name of the limits, such as 'limits'.
+    year : int
+        The survey year of the limits.
+    version : float
+        The modification time of the CPI file, so a new month in the file is projected again.
+
+    Returns
+    -------
+    tuple
+        The limits of every category of every month, indexed by the month,
+        or None if the CPI file has no indices of all the months of the survey year or cannot be used,
+        and the error message if the CPI file is malformed or has no index of a category and no general index.
+        st.cache_resource does not cache exceptions, so the error is returned instead of raised.
+    """
+    try:
+        cpi = load_cpi(path / 'cpi.csv')
+        # Without all the months of the survey year, there is no base to project from, as for an earlier survey year.
+        if sum(m.startswith(f'{year}-') for m in cpi['month']) != 12:
+            return None, None
+        return project_limits(_limits, cpi, year), None
+    except (ValueError, IndexError) as e:
+        return None, str(e)
+
+def current_prices(limits, name, year):
+    """
+    Finds the limits in the prices of the latest month of the CPI file, if it exists.
+
+    Parameters
+    ----------
+    limits : dict
+        The limits of every category, in the prices of the survey year.
+    name : str
+        The name of the limits, such as 'limits'.
+    year : int
+        The survey year of the limits.
+
+    Returns
+    -------
+    tuple
+        The limits of every category, the month of their prices (None for the prices of the survey year),
+        and the error message of a CPI file which cannot be used (None if there is none).
+    """
+    cpi_file = path / 'cpi.csv'
+    projected, error = None, None
+    if cpi_file.exists():
+        projected, error = load_projected(limits, name, year, cpi_file.stat().st_mtime)
+    if not projected:
+        return limits, None, error
+    month = max(projected)
+    return projected[month], month, error
+
+@st.cache_resource
+def rank_cache():
+    """
+    Creates the cache of the ranks, shared by all the sessions.
+
+    Returns
+    -------
+    dict
+        The rank of every (limits, persons, category, amount, rank function) that was looked up.
+    """
+    return {}
+
+# The largest number of ranks in the cache. The cache is emptied when it is full.
+RANK_CACHE_SIZE = 100_000
+
+@timed('cached_rank')
+def cached_rank(limits, persons, category, amount, rank=find_rank):
+    """
+    Finds the rank of a household's expenditure, from the cache if it was already looked up.
+    The limits are kept by st.cache_resource for the life of the process, so they are identified by their id.
+
+    Parameters
+    ----------
+    limits : dict
+        The limits of every category.
+    persons : int
+        The number of persons in the household.
+    category : str
+        The category code.
+    amount : int
+        The monthly expenditure of the household in the category.
+    rank : function, optional
+        find_rank for deciles or percentile_rank for percentiles. The default is find_rank.
+
+    Returns
+    -------
+    int or float
+        The rank.
     """
-    return pd.read_csv(p / (file + ".csv"), index_col=i)
+    cache = rank_cache()
+    # The rank function is identified by its name, since it is wrapped again on every rerun when the metrics are enabled.
+    key = (id(limits), persons, category, amount, rank.__name__)
+    result = cache.get(key)
+    if result is None:
+        if len(cache) >= RANK_CACHE_SIZE:
+            cache.clear()
+        result = cache[key] = rank(limits[category], amount / nefesh_btl(persons))
+    return result
+
+# The year of the survey of limits.csv.
+SURVEY_YEAR = 2022
 
 # Set the path to the data directory and load the decile limits data.
 path = Path("./data")
-data = load_data('limits', path, i='p')
-
-# Creating custom HTML to make the text in the app right-aligned.
-st.markdown("""<style> 
-                div.row-widget.stSelectbox > div {
+data = load_data('limits', path)
+# Load the limits of every survey year, if data_creation.py --survey created them.
+years_data = load_years_data('limits_years', path) if (path / 'limits_years.npy').exists() else None
+# Load the limits of every household size, if data_creation.py --groups nefesh created them.
+groups_data = None
+if (path / 'limits_groups.npy').exists():
+    groups_data, group_columns = load_groups_data('limits_groups', path)
+    if group_columns != ['nefesh']:
+        groups_data = None
+# Load the percentile limits data, if it was created with data_creation.py --grid 100.
+percentiles = load_data('limits_100', path) if (path / 'limits_100.csv').exists() else None
+
+# Creating custom HTML to make the text in the app right-aligned, in a single style block.
+st.markdown("""<style>
+                div.row-widget.stSelectbox > div,
+                div.row-widget.stMultiSelect > div,
+                div.row-widget.stRadio > div {
                     direction:rtl;
                     text_align:right !important;
-                    } </style>""", unsafe_allow_html=True)
-st.markdown("""<style>
+                    }
                 li {
                     text-align:right;
-                } </style>""", unsafe_allow_html=True)
-st.markdown("""<style> 
-                div.row-widget.stMultiSelect > div {
-                 direction:rtl; 
-                 text_align:right !important;
-                 } </style>""", unsafe_allow_html=True)                
-st.markdown("""<style> 
+                    }
                 input {
-                 direction:rtl; 
-                 text-align:center !important;
-                 } 
-                </style>""", unsafe_allow_html=True)
-st.markdown("""<style>
+                    direction:rtl;
+                    text-align:center !important;
+                    }
                 .stTabs > div {
                     direction: rtl;
                     text_align: right;
                     }
                 </style>""", unsafe_allow_html=True)
-st.markdown("""<style> 
-                div.row-widget.stRadio > div {
-                 direction:rtl; 
-                 text_align:right !important;
-                 } 
-                </style>""", unsafe_allow_html=True)
 
 # Display the main title of the app.
 st.markdown("<h1 style='text-align: center;'>?באיזה עשירון הוצאה אתם</h1>", unsafe_allow_html=True)
@@ -180,12 +323,22 @@ c_option_dict = {
                  'c38' : 'תחבורה ותקשורת',
                  'c39' : 'אחר (תכשיטים, סיגריות, תרומות וכו\')'}
 
-# Create tabs for the app: explanations and expenditure decile calculator.
-tabs = ['הסברים', 'מחשבון עשירוני הוצאה']
-tab2, tab1 = st.tabs(tabs)
+@st.fragment
+@timed('calculator')
+def calculator(data, percentiles, year):
+    """
+    Displays the inputs and the results of the calculator. As a fragment, a change of one of its inputs
+    reruns only this function, and not the whole app.
 
-# Expenditure decile calculator tab.
-with tab1:
+    Parameters
+    ----------
+    data : dict
+        The decile limits of every category.
+    percentiles : dict
+        The percentile limits of every category, or None.
+    year : int
+        The survey year of the limits.
+    """
     # Prompt the user to input the number of persons in the household.
     st.markdown("<div style='text-align: center;'>הכניסו את מספר הנפשות במשק הבית (כולל ילדים)</div>", unsafe_allow_html=True)
     persons = st.number_input("הכנס את מספר הנפשות במשק הבית (כולל ילדים)", 
@@ -193,6 +346,11 @@ with tab1:
                               min_value=1, 
                               max_value=20,
                               label_visibility='collapsed')
+    # Compare with households of the same size, if their limits were created.
+    if groups_data is not None and year == SURVEY_YEAR and (persons,) in groups_data:
+        if st.checkbox('השוו למשקי בית עם אותו מספר נפשות'):
+            data = current_prices(groups_data[(persons,)], f'limits_groups_{persons}', year)[0]
+            percentiles = None
     
     # Radio button to select total expenditure or expenditure by category.
     radio_options = {'all' : 'הוצאה כוללת',
@@ -212,13 +370,18 @@ with tab1:
                                          max_value=100000,
                                          step=100,
                                          label_visibility='collapsed')
-        # Calculate expenditure per person and find the corresponding decile.
-        exp_pp = exp_input / nefesh_btl(persons)
-        decile = data.index[data[inp] == find_nearest(data[inp], exp_pp)]
+        # Find the decile of the expenditure per person.
+        decile = cached_rank(data, persons, inp, exp_input)
         text_decile = "עשירון הוצאה כוללת"
-        # Display the decile result.
-        st.markdown(f"<div style='text-align: center;'>{text_decile}</div>", unsafe_allow_html=True)
-        st.markdown("<div style='text-align: center; font-weight: bold;'>{}</div>".format(int(decile[0] * 10)), unsafe_allow_html=True)
+        with timer('render_decile'):
+            # Display the decile result.
+            st.markdown(f"<div style='text-align: center;'>{text_decile}</div>", unsafe_allow_html=True)
+            st.markdown("<div style='text-align: center; font-weight: bold;'>{}</div>".format(decile), unsafe_allow_html=True)
+            if percentiles is not None:
+                # Display the percentile result.
+                text_percentile = "אחוזון הוצאה כוללת"
+                st.markdown(f"<div style='text-align: center;'>{text_percentile}</div>", unsafe_allow_html=True)
+                st.markdown("<div style='text-align: center; font-weight: bold;'>{:g}</div>".format(cached_rank(percentiles, persons, inp, exp_input, percentile_rank)), unsafe_allow_html=True)
         
     else:
         # If expenditure by category is selected, prompt for the expenditure categories.
@@ -242,18 +405,50 @@ with tab1:
                                                  max_value=100000,
                                                  step=10,
                                                  label_visibility='collapsed')
-                # Calculate expenditure per person and find the corresponding decile for each category.
-                exp_pp = exp_input[inp[1]] / nefesh_btl(persons)
-                decile[inp[1]] = data.index[data[inp[1]] == find_nearest(data[inp[1]], exp_pp)]
+                # Find the decile of the expenditure per person in each category. Unchanged categories come from the cache.
+                decile[inp[1]] = cached_rank(data, persons, inp[1], exp_input[inp[1]])
         
         if isinstance(inp, tuple):
-            # Display the decile result for each selected category.
-            exp_cols = st.columns(11)
-            for loc, exp in zip([5,4,6,3,7,2,8,1,9,0], enumerate(expenditure_type)):
-                with exp_cols[loc]:
-                    text_decile = "עשירון " + "{}".format(c_option_dict.get(expenditure_type[exp[0]]))
-                    st.markdown(f"<div style='text-align: center;'>{text_decile}</div>", unsafe_allow_html=True)
-                    st.markdown("<div style='text-align: center; font-weight: bold;'>{}</div>".format(int(decile[exp[1]][0] * 10)), unsafe_allow_html=True)
+            with timer('render_decile'):
+                # Display the decile result for each selected category.
+                exp_cols = st.columns(11)
+                for loc, exp in zip([5,4,6,3,7,2,8,1,9,0], enumerate(expenditure_type)):
+                    with exp_cols[loc]:
+                        text_decile = "עשירון " + "{}".format(c_option_dict.get(expenditure_type[exp[0]]))
+                        st.markdown(f"<div style='text-align: center;'>{text_decile}</div>", unsafe_allow_html=True)
+                        st.markdown("<div style='text-align: center; font-weight: bold;'>{}</div>".format(decile[exp[1]]), unsafe_allow_html=True)
+
+    # Export the metrics, if they are enabled, on every run of the calculator.
+    flush()
+
+# Create tabs for the app: explanations and expenditure decile calculator.
+tabs = ['הסברים', 'מחשבון עשירוני הוצאה']
+tab2, tab1 = st.tabs(tabs)
+
+# Expenditure decile calculator tab.
+with tab1:
+    year = SURVEY_YEAR
+    if years_data is not None:
+        # Select the survey year, the latest by default.
+        st.markdown("<div style='text-align: center;'>בחרו את שנת הסקר</div>", unsafe_allow_html=True)
+        years = sorted(years_data, reverse=True)
+        year = st.selectbox('שנת הסקר',
+                            options=years,
+                            label_visibility='collapsed')
+        data = years_data[year]
+    # Project the limits to current prices.
+    data, month, cpi_error = current_prices(data, 'limits', year)
+    if cpi_error is not None:
+        # A broken CPI file is shown to the user once, since the limits stay in the prices of the survey year.
+        st.warning(f'לא ניתן להצמיד את הגבולות למדד המחירים לצרכן, והם במחירי {year} ({cpi_error})')
+    if percentiles is not None and year == SURVEY_YEAR:
+        percentiles = current_prices(percentiles, 'limits_100', year)[0]
+    else:
+        percentiles = None
+    if month is not None:
+        st.markdown(f"<div style='text-align: center;'>הגבולות מוצמדים למדד המחירים לצרכן של {month}</div>", unsafe_allow_html=True)
+    # The rest of the calculator reruns by itself on every change of its inputs.
+    calculator(data, percentiles, year)
 
 # Explanations tab.
 with tab2:
@@ -269,7 +464,7 @@ with tab2:
     st.markdown("<div style='text-align: right;'>יאללה, לדרך. בחרו בלשונית 'מחשבון עשירוני הוצאה' כדי להתחיל.</div>", unsafe_allow_html=True)
     st.markdown("<div style='text-align: right;'></div>", unsafe_allow_html=True)
     st.markdown("<div style='text-align: right;'></div>", unsafe_allow_html=True)
-    st.markdown("<div style='text-align: right;'>מבוסס על סקר הוצאות משק הבית 2022 של הלשכה המרכזית לסטטיסטיקה.</div>", unsafe_allow_html=True)
+    st.markdown(f"<div style='text-align: right;'>מבוסס על סקר הוצאות משק הבית {year} של הלשכה המרכזית לסטטיסטיקה.</div>", unsafe_allow_html=True)
 # Add some spacing and display social media links.
 st.markdown(" ") 
 st.markdown("<div style='text-align: center;'>מצאו אותי כאן</div>", unsafe_allow_html=True)
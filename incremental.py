@@ -0,0 +1,231 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It keeps the survey sorted on disk, so data_creation.py --incremental can update the limits after corrected
+or supplemental survey rows without sorting the whole survey again.
+
+It performs the following tasks:
+
+Library Imports:
+Imports numpy, and presorted_weighted_quantiles from quantiles.py.
+
+Sorted State:
+The state holds the household ids ('misparmb'), the household expenditures of every category,
+'nefeshstandartit' and 'weight' of every household, and for every category the order of the households
+by their per-person expenditure, with missing expenditures at the end. It is saved as a single .npz file.
+
+Updates:
+An update has the id of every updated household and any of the category columns, 'nefeshstandartit' and 'weight'.
+Households with a known id get the new values, and households with a new id are appended, so they must have
+all the columns. A household is removed by giving it a weight of 0,
+and households with a weight of 0 are left out of the limits.
+Only the households whose per-person expenditure changed in a category are taken out of its order
+and merged back with np.searchsorted, so an update costs a single pass over every category instead of a sort.
+A weight correction does not change any order.
+
+Function Definitions:
+build_state(ids, expenditures, scale, weights, categories): Sorts every category once and creates the state.
+save_state(state, file): Saves the state to a .npz file.
+load_state(file): Loads the state from a .npz file.
+update_state(state, ids, columns): Applies corrected or supplemental households to the state.
+state_limits(state, probs): Calculates the limits of every category from the sorted state,
+the same as weighted_quantiles on the updated survey.
+"""
+
+# Importing the required libraries.
+import numpy as np
+from quantiles import presorted_weighted_quantiles
+
+# The arrays of the state.
+STATE_KEYS = ('ids', 'categories', 'expenditures', 'scale', 'weights', 'orders')
+
+def _per_person(state):
+    """
+    Divides the expenditure of every category by the standardized number of persons.
+
+    Parameters
+    ----------
+    state : dict
+        The state.
+
+    Returns
+    -------
+    numpy array
+        The per-person expenditures (households, categories).
+    """
+    return state['expenditures'] / state['scale'][:, None]
+
+def build_state(ids, expenditures, scale, weights, categories):
+    """
+    Creates the sorted state of a survey.
+
+    Parameters
+    ----------
+    ids : array like
+        The id of every household.
+    expenditures : array like
+        The household expenditures (households, categories).
+    scale : array like
+        The standardized number of persons of every household.
+    weights : array like
+        The weight of every household.
+    categories : list
+        The names of the categories.
+
+    Raises
+    ------
+    ValueError
+        If a household id is repeated.
+
+    Returns
+    -------
+    dict
+        The state.
+    """
+    state = {'ids' : np.asarray(ids, dtype=np.int64),
+             'categories' : np.asarray(categories, dtype=str),
+             'expenditures' : np.asarray(expenditures, dtype=float),
+             'scale' : np.asarray(scale, dtype=float),
+             'weights' : np.asarray(weights, dtype=float)}
+    if len(np.unique(state['ids'])) != len(state['ids']):
+        raise ValueError('the household ids must be unique')
+    state['orders'] = np.argsort(_per_person(state).T, axis=1)
+    return state
+
+def save_state(state, file):
+    """
+    Saves the state.
+
+    Parameters
+    ----------
+    state : dict
+        The state.
+    file : Path object
+        The .npz file. Overwritten if it already exists.
+    """
+    file.parent.mkdir(parents=True, exist_ok=True)
+    # Writing to a temporary file first, so an interrupted run does not leave a broken state.
+    partial = file.with_name(file.stem + '.partial.npz')
+    np.savez(partial, **{k : state[k] for k in STATE_KEYS})
+    partial.replace(file)
+
+def load_state(file):
+    """
+    Loads the state.
+
+    Parameters
+    ----------
+    file : Path object
+        The .npz file.
+
+    Returns
+    -------
+    dict
+        The state.
+    """
+    with np.load(file) as saved:
+        return {k : saved[k] for k in STATE_KEYS}
+
+def update_state(state, ids, columns):
+    """
+    Applies corrected or supplemental households to the state.
+
+    Parameters
+    ----------
+    state : dict
+        The state. It is not changed.
+    ids : array like
+        The id of every updated household.
+    columns : dict
+        The new values of every updated household, by column: any of the categories,
+        'nefeshstandartit' and 'weight'.
+
+    Raises
+    ------
+    ValueError
+        If an id is repeated, a column is unknown, or a new household does not have all the columns.
+
+    Returns
+    -------
+    tuple
+        The updated state, and the number of updated and of appended households.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    categories = list(state['categories'])
+    unknown = set(columns) - set(categories) - {'nefeshstandartit', 'weight'}
+    if unknown:
+        raise ValueError(f'unknown columns: {", ".join(sorted(unknown))}')
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError('the updated household ids must be unique')
+
+    # Finding the updated households, and appending the new ones at the end.
+    by_id = np.argsort(state['ids'])
+    found = np.searchsorted(state['ids'], ids, sorter=by_id)
+    found = np.minimum(found, len(by_id) - 1)
+    known = state['ids'][by_id[found]] == ids
+    new = ~known
+    if new.any() and len(columns) < len(categories) + 2:
+        raise ValueError('new households must have all the categories, nefeshstandartit and weight')
+    rows = np.empty(len(ids), dtype=np.intp)
+    rows[known] = by_id[found[known]]
+    rows[new] = len(state['ids']) + np.arange(new.sum())
+    n = len(state['ids']) + new.sum()
+
+    updated = {'ids' : np.concatenate([state['ids'], ids[new]]),
+               'categories' : state['categories'],
+               'expenditures' : np.concatenate([state['expenditures'], np.full((new.sum(), len(categories)), np.nan)]),
+               'scale' : np.concatenate([state['scale'], np.ones(new.sum())]),
+               'weights' : np.concatenate([state['weights'], np.zeros(new.sum())])}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=float)
+        if name == 'weight':
+            updated['weights'][rows] = values
+        elif name == 'nefeshstandartit':
+            updated['scale'][rows] = values
+        else:
+            updated['expenditures'][rows, categories.index(name)] = values
+
+    # Merging the households whose per-person expenditure changed back into the order of every category.
+    before = _per_person(state)
+    after = _per_person(updated)
+    orders = np.empty((len(categories), n), dtype=state['orders'].dtype)
+    for j in range(len(categories)):
+        moved = np.zeros(n, dtype=bool)
+        moved[len(state['ids']):] = True
+        old = before[rows[known], j]
+        changed = after[rows[known], j]
+        moved[rows[known]] = ~((old == changed) | (np.isnan(old) & np.isnan(changed)))
+        order = state['orders'][j]
+        order = order[~moved[order]]
+        insert = np.flatnonzero(moved)
+        insert = insert[np.argsort(after[insert, j])]
+        at = np.searchsorted(after[order, j], after[insert, j], side='right')
+        orders[j] = np.insert(order, at, insert)
+    updated['orders'] = orders
+    return updated, int(known.sum()), int(new.sum())
+
+def state_limits(state, probs):
+    """
+    Calculates the limits of every category from the sorted state.
+
+    Parameters
+    ----------
+    state : dict
+        The state.
+    probs : numpy array
+        The quantiles to calculate.
+
+    Returns
+    -------
+    numpy array
+        The limits, with a row for every quantile and a column for every category.
+    """
+    values = _per_person(state)
+    results = np.empty((len(probs), len(state['categories'])))
+    for j, order in enumerate(state['orders']):
+        # Leaving out the removed households.
+        order = order[state['weights'][order] > 0]
+        results[:, j] = presorted_weighted_quantiles(values[order, j], state['weights'][order], probs)
+    return results
@@ -0,0 +1,200 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It reads the Expenditure Survey for data_creation.py, parsing the CSV file only once.
+
+It performs the following tasks:
+
+Library Imports:
+Imports hashlib and json for the cache key, and pandas and numpy for the survey.
+pyarrow is needed for the Parquet and Feather cache files.
+
+Column Pruning:
+Reads only the required columns of the survey (by default the category columns, from 'c3' to 'c39',
+'nefeshstandartit' and 'weight'), matching their names regardless of case, and makes the names lowercase.
+
+Dtype Downcasting:
+Casts every column to the smallest dtype which holds all its values exactly: whole numbers to the smallest
+integer dtype, and other numbers to float32 when no value changes. Columns which would lose any precision
+stay float64, so the limits calculated from the survey do not change.
+
+Caching:
+Stores the parsed survey as a Parquet (or Feather) file in the cache folder, named after the SHA-256 hash
+of the survey file and the required columns. A survey file which did not change is read from the cache
+without parsing the CSV again, and a survey file which changed gets a new cache file.
+
+Function Definitions:
+file_hash(file): Calculates the SHA-256 hash of a file, block by block.
+file_columns(file): Reads the names of all the columns of a survey file.
+survey_columns(file, columns=None): Finds the names of the required columns in the survey file.
+downcast(frame): Casts every column to the smallest lossless dtype.
+load_survey(file, columns=None, cache=None, fmt='parquet'): Reads the required columns of the survey,
+from the cache if possible.
+
+Usage:
+from ingestion import load_survey
+mbs = load_survey(Path('survey.csv'), cache=Path('./cache'))
+"""
+
+# Importing the required libraries.
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+# The size of the blocks read when hashing a file, in bytes.
+HASH_BLOCK = 1024 * 1024
+
+# The cache file formats.
+FORMATS = {'parquet' : '.parquet', 'feather' : '.feather'}
+
+def file_hash(file):
+    """
+    Calculates the SHA-256 hash of a file, block by block.
+
+    Parameters
+    ----------
+    file : Path object
+        The file.
+
+    Returns
+    -------
+    str
+        The hash, as a hexadecimal string.
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_columns(file):
+    """
+    Reads the names of all the columns of a survey file, without reading its rows.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+
+    Returns
+    -------
+    list
+        The names of the columns as they are in the file.
+    """
+    if file.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(file).names
+    return list(pd.read_csv(file, nrows=0).columns)
+
+def survey_columns(file, columns=None):
+    """
+    Finds the names of the required columns in the survey file.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+    columns : list, optional
+        The lowercase names of the required columns. The default is None, for the category columns,
+        from 'c3' to 'c39', 'nefeshstandartit' and 'weight'.
+
+    Returns
+    -------
+    list
+        The names of the required columns as they are in the file, in the order of the file.
+    """
+    names = file_columns(file)
+    lower = [n.lower() for n in names]
+    if columns is None:
+        wanted = set(lower[lower.index('c3') : lower.index('c39') + 1]) | {'nefeshstandartit', 'weight'}
+    else:
+        wanted = set(columns)
+    missing = wanted - set(lower)
+    if missing:
+        raise ValueError(f'{file} has no {", ".join(sorted(missing))} columns')
+    return [n for n, l in zip(names, lower) if l in wanted]
+
+def downcast(frame):
+    """
+    Casts every column to the smallest dtype which holds all its values exactly.
+
+    Parameters
+    ----------
+    frame : DataFrame
+        The numeric columns.
+
+    Returns
+    -------
+    DataFrame
+        The columns, with the smallest lossless dtypes.
+    """
+    columns = {}
+    for name, column in frame.items():
+        values = column.to_numpy()
+        if values.dtype.kind == 'f' and np.isfinite(values).all() and (values == np.round(values)).all():
+            # Whole numbers become integers. Integers larger than 2 ** 53 are not exact as floats anyway.
+            column = pd.to_numeric(column.astype(np.int64), downcast='integer')
+        elif values.dtype.kind in 'iu':
+            column = pd.to_numeric(column, downcast='integer')
+        elif values.dtype.kind == 'f':
+            small = values.astype(np.float32)
+            if np.array_equal(small.astype(values.dtype), values, equal_nan=True):
+                column = column.astype(np.float32)
+        columns[name] = column
+    return pd.DataFrame(columns, index=frame.index)
+
+def load_survey(file, columns=None, cache=None, fmt='parquet'):
+    """
+    Reads the required columns of the survey, from the cache if possible.
+
+    Parameters
+    ----------
+    file : Path object
+        The survey CSV or Parquet file.
+    columns : list, optional
+        The lowercase names of the required columns. The default is None, for the category columns,
+        from 'c3' to 'c39', 'nefeshstandartit' and 'weight'.
+    cache : Path object, optional
+        The cache folder. The default is None, which parses the survey without a cache.
+    fmt : str, optional
+        The cache file format, 'parquet' or 'feather'. The default is 'parquet'.
+
+    Returns
+    -------
+    DataFrame
+        The required columns, with lowercase names and the smallest lossless dtypes.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt must be 'parquet' or 'feather', not {fmt!r}")
+    names = survey_columns(file, columns)
+
+    # A Parquet survey is already parsed, so it is not cached.
+    if file.suffix == '.parquet':
+        mbs = pd.read_parquet(file, columns=names)
+        mbs.columns = mbs.columns.str.lower()
+        return downcast(mbs)
+
+    if cache is not None:
+        key = hashlib.sha256(json.dumps([file_hash(file), names]).encode()).hexdigest()[:32]
+        cache_file = cache / f'{file.stem}-{key}{FORMATS[fmt]}'
+        if cache_file.exists():
+            return pd.read_parquet(cache_file) if fmt == 'parquet' else pd.read_feather(cache_file)
+
+    # Parsing only the required columns, as float64 the same as reading the whole survey, before downcasting.
+    mbs = pd.read_csv(file, usecols=names, dtype={n : np.float64 for n in names})
+    mbs.columns = mbs.columns.str.lower()
+    mbs = downcast(mbs)
+
+    if cache is not None:
+        cache.mkdir(parents=True, exist_ok=True)
+        # Writing to a temporary file first, so an interrupted run does not leave a broken cache file.
+        partial = cache_file.with_name(cache_file.name + '.partial')
+        if fmt == 'parquet':
+            mbs.to_parquet(partial, index=False)
+        else:
+            mbs.reset_index(drop=True).to_feather(partial)
+        partial.replace(cache_file)
+    return mbs
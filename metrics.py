@@ -0,0 +1,212 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It records how long the hot paths of the app take, so the time of a request in production can be broken down.
+
+It performs the following tasks:
+
+Library Imports:
+Imports the standard library only, so the instrumentation adds no import time.
+
+Enabling:
+The metrics are recorded only if the EXPENDITURE_METRICS environment variable is set (to any non-empty value).
+When it is not set, timed returns the function itself and timer returns a shared empty context manager,
+so the instrumented code runs exactly as without the instrumentation.
+
+Histograms:
+Every instrumented function or block has a timing histogram, with the number of calls, the total time
+and the number of calls in every bucket of BUCKETS. The histograms are kept by the process,
+so they add up the calls of all the sessions, and are guarded by a lock, since every session runs in a thread.
+
+Export:
+The histograms are exported in the Prometheus text format, or as JSON for a file name ending with '.json'.
+If the EXPENDITURE_METRICS_FILE environment variable is set, flush writes them to that file at most once every
+EXPORT_INTERVAL seconds, replacing it at once, so it can be read by the textfile collector of the node exporter.
+
+Function Definitions:
+observe(name, seconds): Records a single call.
+timed(name): A decorator which records the calls of a function.
+timer(name): A context manager which records the runs of a block.
+prometheus_text(): Formats the histograms in the Prometheus text format.
+write_metrics(file): Writes the histograms to a file.
+flush(): Writes the histograms to EXPENDITURE_METRICS_FILE, if EXPORT_INTERVAL seconds passed since the last time.
+
+Usage:
+EXPENDITURE_METRICS=1 EXPENDITURE_METRICS_FILE=metrics.prom streamlit run exp_decile.py
+"""
+
+# Importing the required libraries.
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+# Recording the metrics only if the EXPENDITURE_METRICS environment variable is set.
+ENABLED = bool(os.environ.get('EXPENDITURE_METRICS'))
+
+# The file the metrics are flushed to, which can be given with the EXPENDITURE_METRICS_FILE environment variable.
+METRICS_FILE = os.environ.get('EXPENDITURE_METRICS_FILE')
+
+# The smallest number of seconds between two flushes.
+EXPORT_INTERVAL = 10.0
+
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# The name of the histogram metric in the Prometheus text format.
+METRIC = 'expenditure_decile_duration_seconds'
+
+# The count of every bucket (the last for values above all of BUCKETS), the total time and the number of calls,
+# of every name.
+_histograms = {}
+_lock = threading.Lock()
+_last_flush = [0.0]
+
+# The context manager of timer when the metrics are disabled.
+_NULL = contextlib.nullcontext()
+
+def observe(name, seconds):
+    """
+    Records a single call.
+
+    Parameters
+    ----------
+    name : str
+        The name of the function or block.
+    seconds : float
+        The time of the call.
+    """
+    i = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+def timed(name):
+    """
+    Creates a decorator which records the calls of a function.
+
+    Parameters
+    ----------
+    name : str
+        The name of the function in the metrics.
+
+    Returns
+    -------
+    function
+        The decorator. When the metrics are disabled, it returns the function itself.
+    """
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def timer(name):
+    """
+    Creates a context manager which records the runs of a block.
+
+    Parameters
+    ----------
+    name : str
+        The name of the block in the metrics.
+
+    Returns
+    -------
+    context manager
+        The timer. When the metrics are disabled, a shared context manager which does nothing.
+    """
+    return _timer(name) if ENABLED else _NULL
+
+def _snapshot():
+    """
+    Copies the histograms, so they can be formatted without holding the lock.
+
+    Returns
+    -------
+    dict
+        The bucket counts, the total time and the number of calls of every name.
+    """
+    with _lock:
+        return {name : (list(h[0]), h[1], h[2]) for name, h in sorted(_histograms.items())}
+
+def prometheus_text():
+    """
+    Formats the histograms in the Prometheus text format.
+
+    Returns
+    -------
+    str
+        The histograms, with cumulative buckets, the total time and the number of calls of every name.
+    """
+    lines = [f'# HELP {METRIC} The time of the instrumented functions and blocks of the app.',
+             f'# TYPE {METRIC} histogram']
+    for name, (counts, total, calls) in _snapshot().items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{METRIC}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC}_sum{{name="{name}"}} {total!r}')
+        lines.append(f'{METRIC}_count{{name="{name}"}} {calls}')
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(file):
+    """
+    Writes the histograms to a file, in the Prometheus text format, or as JSON for a '.json' file.
+
+    Parameters
+    ----------
+    file : Path object or str
+        The file. Overwritten if it already exists.
+    """
+    file = Path(file)
+    if file.suffix == '.json':
+        text = json.dumps({name : {'buckets' : dict(zip([str(b) for b in BUCKETS] + ['+Inf'], counts)),
+                                   'sum' : total,
+                                   'count' : calls}
+                           for name, (counts, total, calls) in _snapshot().items()}, indent=1)
+    else:
+        text = prometheus_text()
+    # Writing to a temporary file first, so a reader never sees a partly written file.
+    partial = file.with_name(file.name + '.partial')
+    partial.write_text(text)
+    partial.replace(file)
+
+def flush():
+    """
+    Writes the histograms to EXPENDITURE_METRICS_FILE, if EXPORT_INTERVAL seconds passed since the last time.
+    Does nothing when the metrics are disabled or no file is given.
+    """
+    if not ENABLED or not METRICS_FILE:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_flush[0] < EXPORT_INTERVAL:
+            return
+        _last_flush[0] = now
+    write_metrics(METRICS_FILE)
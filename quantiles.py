@@ -0,0 +1,652 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It calculates weighted quantiles for data_creation.py.
+
+It performs the following tasks:
+
+Library Imports:
+Imports numpy for numerical operations, and concurrent.futures for spreading the columns across workers.
+
+Function Definitions:
+quantile_grid(size): The probabilities of a grid of quantiles, such as deciles (10), percentiles (100) or permilles (1000).
+parallel_map(func, items, workers=1, executor='thread'): Calls a function on every item, in a thread pool
+or a process pool.
+weighted_quantiles(values, weights, probs, workers=1, executor='thread'): Calculates exact weighted quantiles
+of every column at once, with a single argsort of all the columns, cumulative weights and np.searchsorted.
+With more than one worker, the columns are sorted in parallel.
+presorted_weighted_quantiles(values, weights, probs): Calculates weighted quantiles of a column which is
+already sorted, such as the sorted state of data_creation.py --incremental.
+grouped_weighted_quantiles(values, weights, groups, probs, n_groups=None): Calculates weighted quantiles
+of every column within every group of rows, sorting all the groups at once by group and value, with a single
+np.searchsorted call for all the groups, instead of a loop over the groups.
+weighted_cdf_knots(values, weights, knots=1000): Compresses the weighted empirical CDF of every column
+into a small table of knots, for interpolating continuous percentiles.
+streaming_weighted_quantiles(read_chunks, probs, tolerance=0.01, bins=1024, max_passes=30):
+Calculates weighted quantiles of data too large to be held in memory, reading it again and again
+in chunks, with a bounded amount of memory.
+
+Quantile Definition:
+The quantiles follow the definition of DescrStatsW from statsmodels: the weights are summed over
+ties, and the quantile of p is the lowest value whose cumulative weight reaches p times the total weight.
+If the cumulative weight hits p times the total weight exactly, the quantile is the average
+of the value and the next value.
+Missing values are ignored, together with their weights.
+grouped_weighted_quantiles accumulates the weights over all the groups, so the cumulative weights of a group
+may differ from its own cumulative weights by rounding. With whole-number weights they are exactly the same.
+
+Streaming Algorithm:
+The first pass finds the lowest and highest value and the total weight of every column.
+Every following pass builds a weighted histogram of the interval that is known to contain every quantile,
+and narrows the interval to the lowest and highest values of the histogram bin the quantile fell in.
+A quantile is done when its interval holds a single value, or when the interval is no wider than the tolerance,
+in which case the middle of the interval is returned.
+Exact hits of a cumulative weight are matched within STREAM_HIT of the total weight, since the weights of the chunks
+are summed in another order than in a single cumsum, and their sums differ from it in the last bits.
+The memory used depends only on the chunk size, the number of columns, quantiles and bins.
+"""
+
+# Importing the required libraries.
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Tolerance for the exact hit of a cumulative weight, the same as DescrStatsW.
+EXACT_HIT = 1e-10
+
+# Tolerance for the exact hit of a cumulative weight in streaming, relative to the total weight of the column.
+# The weights are summed chunk by chunk and bin by bin, in another order than a single cumsum, so their sums
+# differ in the last bits from the sums of DescrStatsW, more the larger the total weight.
+STREAM_HIT = 1e-12
+
+def quantile_grid(size):
+    """
+    Creates the probabilities of a grid of quantiles.
+
+    Parameters
+    ----------
+    size : int
+        The number of groups, for example 10 for deciles or 100 for percentiles.
+
+    Returns
+    -------
+    numpy array
+        The probabilities 1/size, 2/size, ..., (size - 1)/size.
+    """
+    if size < 2:
+        raise ValueError(f'size must be at least 2, not {size}')
+    return np.arange(1, size) / size
+
+def parallel_map(func, items, workers=1, executor='thread'):
+    """
+    Calls a function on every item, in parallel.
+
+    Parameters
+    ----------
+    func : function
+        The function to call. It must be defined at module level for a process pool.
+    items : iterable
+        The arguments of the calls.
+    workers : int, optional
+        The number of workers. None means the number of CPUs. The default is 1, which calls the function
+        on every item one after the other.
+    executor : str, optional
+        'thread' for a thread pool, which works well for NumPy sorts that release the GIL,
+        or 'process' for a process pool. The default is 'thread'.
+
+    Returns
+    -------
+    list
+        The results of the calls, in the order of the items.
+    """
+    items = list(items)
+    workers = min(workers or os.cpu_count(), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}")
+    pool = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+    with pool(max_workers=workers) as p:
+        return list(p.map(func, items))
+
+def _histogram(values, weights, lo, hi, bins):
+    """
+    Calculates a weighted histogram of the values inside an interval.
+
+    Parameters
+    ----------
+    values : numpy array
+        The values of a single column, without missing values.
+    weights : numpy array
+        The weights of the values.
+    lo : float
+        The lower end of the interval.
+    hi : float
+        The upper end of the interval.
+    bins : int
+        The number of bins.
+
+    Returns
+    -------
+    tuple
+        The weight of the values below the interval, and the weight, lowest value
+        and highest value in every bin.
+    """
+    below = weights[values < lo].sum()
+    inside = (values >= lo) & (values <= hi)
+    v = values[inside]
+    w = weights[inside]
+    if hi > lo:
+        b = np.minimum(((v - lo) * (bins / (hi - lo))).astype(np.int64), bins - 1)
+    else:
+        b = np.zeros(len(v), dtype=np.int64)
+    hist = np.bincount(b, weights=w, minlength=bins)
+    bin_min = np.full(bins, np.inf)
+    bin_max = np.full(bins, -np.inf)
+    np.minimum.at(bin_min, b, v)
+    np.maximum.at(bin_max, b, v)
+    return below, hist, bin_min, bin_max
+
+def _sorted_quantiles(values, weights, probs):
+    """
+    Calculates weighted quantiles of a single sorted column.
+
+    Parameters
+    ----------
+    values : numpy array
+        The sorted values of the column, with missing values at the end.
+    weights : numpy array
+        The weights of the sorted values.
+    probs : numpy array
+        The probabilities of the quantiles.
+
+    Returns
+    -------
+    numpy array
+        The quantiles.
+    """
+    # Dropping the missing values, which argsort puts at the end.
+    present = np.count_nonzero(~np.isnan(values))
+    values = values[:present]
+    weights = weights[:present]
+
+    # Summing the weights over ties.
+    starts = _tie_starts(values)
+    return _cumulative_quantiles(values[starts], np.cumsum(np.add.reduceat(weights, starts)), probs)
+
+def presorted_weighted_quantiles(values, weights, probs):
+    """
+    Calculates weighted quantiles of a single column which is already sorted, without sorting it again.
+
+    Parameters
+    ----------
+    values : array like
+        The sorted values of the column, with missing values at the end.
+    weights : array like
+        The weights of the sorted values.
+    probs : array like
+        The probabilities of the quantiles, between 0 and 1.
+
+    Returns
+    -------
+    numpy array
+        The quantiles.
+    """
+    return _sorted_quantiles(np.asarray(values, dtype=float),
+                             np.asarray(weights, dtype=float),
+                             np.atleast_1d(np.asarray(probs, dtype=float)))
+
+def _tie_starts(values):
+    """
+    Finds where every group of tied values starts in a sorted column.
+
+    Parameters
+    ----------
+    values : numpy array
+        The sorted values, without missing values.
+
+    Returns
+    -------
+    numpy array
+        The position of the first value of every group.
+    """
+    return np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+
+def _cumulative_quantiles(values, cweights, probs, skip_empty=False):
+    """
+    Calculates weighted quantiles from the distinct values of a column and their cumulative weights.
+
+    Parameters
+    ----------
+    values : numpy array
+        The distinct sorted values.
+    cweights : numpy array
+        The cumulative weight of every value.
+    probs : numpy array
+        The probabilities of the quantiles.
+    skip_empty : bool, optional
+        Skip values with no weight when looking for the next value after an exact hit.
+        Used by the bootstrap, where values missing from a replicate have no weight. The default is False.
+
+    Returns
+    -------
+    numpy array
+        The quantiles.
+    """
+    targets = probs * cweights[-1]
+    ii = np.searchsorted(cweights, targets)
+    results = values[ii]
+
+    # Exact hits get the average of the value and the next value.
+    jj = np.flatnonzero(np.abs(targets - cweights[ii]) < EXACT_HIT)
+    if skip_empty:
+        after = np.searchsorted(cweights, cweights[ii[jj]], side='right')
+    else:
+        after = ii[jj] + 1
+    jj, after = jj[after < len(cweights)], after[after < len(cweights)]
+    results[jj] = (values[ii[jj]] + values[after]) / 2
+    return results
+
+def _column_quantiles(job):
+    """
+    Calculates weighted quantiles of some of the columns, for parallel_map.
+
+    Parameters
+    ----------
+    job : tuple
+        The values of the columns, the weights and the probabilities.
+
+    Returns
+    -------
+    numpy array
+        The quantiles of the columns.
+    """
+    return weighted_quantiles(*job)
+
+def weighted_quantiles(values, weights, probs, workers=1, executor='thread'):
+    """
+    Calculates exact weighted quantiles of every column, the same as DescrStatsW(values, weights).quantile(probs).
+
+    Parameters
+    ----------
+    values : array like
+        The data, as a 2-D array (rows, columns) or a 1-D array of a single column.
+    weights : array like
+        The weight of every row.
+    probs : array like
+        The probabilities of the quantiles, between 0 and 1.
+    workers : int, optional
+        The number of workers sorting the columns in parallel. None means the number of CPUs.
+        The default is 1.
+    executor : str, optional
+        'thread' or 'process', see parallel_map. The default is 'thread'.
+
+    Returns
+    -------
+    numpy array
+        The quantiles, with a row for every probability and a column for every column in the data.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    weights = np.asarray(weights, dtype=float)
+    probs = np.atleast_1d(np.asarray(probs, dtype=float))
+
+    # Spreading the columns across the workers, a column for every job.
+    if (workers is None or workers > 1) and values.shape[1] > 1:
+        jobs = [(values[:, j], weights, probs) for j in range(values.shape[1])]
+        return np.hstack(parallel_map(_column_quantiles, jobs, workers, executor))
+
+    # Sorting all the columns at once, with every column contiguous in memory.
+    columns = np.ascontiguousarray(values.T)
+    order = np.argsort(columns, axis=1)
+    sorted_values = np.take_along_axis(columns, order, axis=1)
+    sorted_weights = weights[order]
+
+    results = np.empty((len(probs), len(columns)))
+    for j in range(len(columns)):
+        results[:, j] = _sorted_quantiles(sorted_values[j], sorted_weights[j], probs)
+    return results
+
+def grouped_weighted_quantiles(values, weights, groups, probs, n_groups=None):
+    """
+    Calculates weighted quantiles of every column within every group of rows, with a single sort.
+
+    Parameters
+    ----------
+    values : array like
+        The data, as a 2-D array (rows, columns) or a 1-D array of a single column.
+    weights : array like
+        The weight of every row.
+    groups : array like
+        The group of every row, as a code from 0 to n_groups - 1.
+    probs : array like
+        The probabilities of the quantiles, between 0 and 1.
+    n_groups : int, optional
+        The number of groups. The default is None, for the largest code plus 1.
+
+    Returns
+    -------
+    numpy array
+        The quantiles (groups, probabilities, columns), with NaN for a group with no values in a column.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    weights = np.asarray(weights, dtype=float)
+    groups = np.asarray(groups, dtype=np.intp)
+    probs = np.atleast_1d(np.asarray(probs, dtype=float))
+    n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+    rows, columns = values.shape
+    segments = columns * n_groups
+
+    # Every column of every group is a segment. All the segments are sorted together by segment and value,
+    # the same as np.lexsort but faster: every column is sorted by value, and then by group with a stable sort,
+    # which is a radix sort for small integer codes.
+    columns_values = np.ascontiguousarray(values.T)
+    order = np.argsort(columns_values, axis=1)
+    codes = groups.astype(np.int16 if n_groups <= np.iinfo(np.int16).max else np.intp)
+    order = np.take_along_axis(order, np.argsort(codes[order], axis=1, kind='stable'), axis=1)
+    flat = np.take_along_axis(columns_values, order, axis=1).ravel()
+    # The rows of every column are now in order of group, so the segment of every row follows from the group sizes.
+    segment = np.repeat(np.arange(segments), np.tile(np.bincount(groups, minlength=n_groups), columns))
+    flat_weights = weights[order].ravel()
+
+    # Dropping the missing values.
+    present = ~np.isnan(flat)
+    flat, segment, flat_weights = flat[present], segment[present], flat_weights[present]
+    if not len(flat):
+        return np.full((n_groups, len(probs), columns), np.nan)
+
+    # Summing the weights over ties within every segment, and accumulating them over all the segments.
+    starts = np.flatnonzero(np.r_[True, (flat[1:] != flat[:-1]) | (segment[1:] != segment[:-1])])
+    distinct, owner = flat[starts], segment[starts]
+    cweights = np.cumsum(np.add.reduceat(flat_weights, starts))
+
+    # The distinct values of every segment, and its cumulative weight before it and in it.
+    first = np.searchsorted(owner, np.arange(segments))
+    last = np.searchsorted(owner, np.arange(segments), side='right')
+    empty = first == last
+    before = np.where(first > 0, cweights[first - 1], 0)
+    total = np.where(empty, 0, cweights[last - 1]) - before
+
+    # The quantiles of all the segments, with one np.searchsorted call over the cumulative weights.
+    targets = probs * total[:, None]
+    ii = np.searchsorted(cweights, before[:, None] + targets)
+    ii = np.clip(ii, first[:, None], np.maximum(last - 1, first)[:, None])
+    ii[empty] = 0
+    results = distinct[ii]
+
+    # Exact hits get the average of the value and the next value of the segment.
+    hit = (np.abs(cweights[ii] - before[:, None] - targets) < EXACT_HIT) & (ii + 1 < last[:, None])
+    results[hit] = (distinct[ii[hit]] + distinct[ii[hit] + 1]) / 2
+    results[empty] = np.nan
+    return results.reshape(columns, n_groups, len(probs)).transpose(1, 2, 0)
+
+def streaming_weighted_quantiles(read_chunks, probs, tolerance=0.01, bins=1024, max_passes=30):
+    """
+    Calculates weighted quantiles of every column, reading the data in chunks.
+
+    Parameters
+    ----------
+    read_chunks : function
+        A function with no arguments, which returns a new iterator over the data every time
+        it is called. Every item is a tuple of a 2-D values array (rows, columns) and a 1-D weights array.
+    probs : array like
+        The probabilities of the quantiles, between 0 and 1.
+    tolerance : float, optional
+        The largest allowed distance from the exact quantile. The default is 0.01.
+        An exact hit of a cumulative weight (which DescrStatsW answers with the average of two values)
+        is matched within STREAM_HIT of the total weight, and not EXACT_HIT, since the chunked sums round
+        differently. When a cumulative weight is within STREAM_HIT of the total weight of a target,
+        DescrStatsW's own answer depends on how its sums round (the average of two values, or the higher one),
+        so only in this case can the result be further than the tolerance from it, by up to half the gap
+        between the two values.
+    bins : int, optional
+        The number of histogram bins in every pass. The default is 1024.
+    max_passes : int, optional
+        The largest number of passes over the data. The default is 30.
+
+    Returns
+    -------
+    numpy array
+        The quantiles, with a row for every probability and a column for every column in the data.
+    """
+    probs = np.atleast_1d(np.asarray(probs, dtype=float))
+
+    # First pass: the lowest value, highest value and total weight of every column.
+    lo = hi = total = None
+    for values, weights in read_chunks():
+        values = np.asarray(values, dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        present = ~np.isnan(values)
+        chunk_lo = np.where(present, values, np.inf).min(axis=0)
+        chunk_hi = np.where(present, values, -np.inf).max(axis=0)
+        chunk_total = (present * weights[:, None]).sum(axis=0)
+        if lo is None:
+            lo, hi, total = chunk_lo, chunk_hi, chunk_total
+        else:
+            lo = np.minimum(lo, chunk_lo)
+            hi = np.maximum(hi, chunk_hi)
+            total = total + chunk_total
+
+    n_cols = len(total)
+    targets = probs[:, None] * total[None, :]
+    hit = np.maximum(EXACT_HIT, STREAM_HIT * total)
+    # The interval that contains every quantile.
+    interval_lo = np.tile(lo, (len(probs), 1))
+    interval_hi = np.tile(hi, (len(probs), 1))
+    # Quantiles which were an exact hit and are waiting for the next value above them.
+    waiting = np.zeros((len(probs), n_cols), dtype=bool)
+    results = np.full((len(probs), n_cols), np.nan)
+    done = interval_lo == interval_hi
+    results[done] = interval_lo[done]
+
+    for _ in range(max_passes):
+        if done.all():
+            break
+        # The distinct intervals of every column, so quantiles sharing an interval are counted once.
+        jobs = {}
+        for i, j in zip(*np.nonzero(~done)):
+            key = (j, interval_lo[i, j], interval_hi[i, j], waiting[i, j])
+            jobs.setdefault(key, []).append(i)
+        below = {key : 0.0 for key in jobs}
+        hists = {key : (np.zeros(bins), np.full(bins, np.inf), np.full(bins, -np.inf)) for key in jobs}
+        next_value = {key : np.inf for key in jobs}
+
+        for values, weights in read_chunks():
+            values = np.asarray(values, dtype=float)
+            weights = np.asarray(weights, dtype=float)
+            columns = {}
+            for key in jobs:
+                j, a, b, wait = key
+                if j not in columns:
+                    present = ~np.isnan(values[:, j])
+                    columns[j] = values[present, j], weights[present]
+                v, w = columns[j]
+                if wait:
+                    # The lowest value above the exact hit.
+                    above = v[v > b]
+                    if len(above):
+                        next_value[key] = min(next_value[key], above.min())
+                    continue
+                chunk_below, hist, bin_min, bin_max = _histogram(v, w, a, b, bins)
+                below[key] += chunk_below
+                hists[key][0][:] += hist
+                np.minimum(hists[key][1], bin_min, out=hists[key][1])
+                np.maximum(hists[key][2], bin_max, out=hists[key][2])
+
+        for key, rows in jobs.items():
+            j, a, b, wait = key
+            if wait:
+                for i in rows:
+                    results[i, j] = (b + next_value[key]) / 2 if np.isfinite(next_value[key]) else b
+                    done[i, j] = True
+                continue
+            hist, bin_min, bin_max = hists[key]
+            # Only the bins with values in them.
+            filled = np.flatnonzero(np.isfinite(bin_min))
+            cum = below[key] + np.cumsum(hist[filled])
+            for i in rows:
+                t = targets[i, j]
+                f = min(np.searchsorted(cum, t), len(filled) - 1)
+                # A hit whose sum rounded to just below the target is found in the bin before.
+                if f > 0 and abs(cum[f - 1] - t) < hit[j]:
+                    f -= 1
+                k = filled[f]
+                if abs(cum[f] - t) < hit[j]:
+                    # An exact hit: the quantile is the average of the bin's highest value and the next value.
+                    if f + 1 < len(filled):
+                        results[i, j] = (bin_max[k] + bin_min[filled[f + 1]]) / 2
+                        done[i, j] = True
+                    else:
+                        interval_hi[i, j] = bin_max[k]
+                        waiting[i, j] = True
+                    continue
+                interval_lo[i, j], interval_hi[i, j] = bin_min[k], bin_max[k]
+                if bin_max[k] - bin_min[k] <= tolerance:
+                    results[i, j] = (bin_min[k] + bin_max[k]) / 2
+                    done[i, j] = True
+
+    # Quantiles which did not converge in max_passes get the middle of their interval.
+    left = ~done
+    results[left] = (interval_lo[left] + interval_hi[left]) / 2
+    return results
+
+def weighted_cdf_knots(values, weights, knots=1000):
+    """
+    Compresses the weighted empirical CDF of every column into a table of knots.
+
+    Parameters
+    ----------
+    values : array like
+        The data, as a 2-D array (rows, columns) or a 1-D array of a single column.
+    weights : array like
+        The weight of every row.
+    knots : int, optional
+        The largest number of knots of every column. The knots are spread evenly over the
+        cumulative weight, so no gap between two knots holds more than 1/knots of the weight.
+        The default is 1000.
+
+    Returns
+    -------
+    list
+        For every column, a tuple of the knot values and the share of the weight at or below every knot value.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    weights = np.asarray(weights, dtype=float)
+
+    tables = []
+    for order, starts, distinct in _presort(values):
+        cdf = np.cumsum(np.add.reduceat(weights[order], starts))
+        cdf /= cdf[-1]
+        # The first distinct value that reaches every level, without repeats.
+        idx = np.unique(np.searchsorted(cdf, np.linspace(0, 1, knots + 1)[1:] - EXACT_HIT))
+        idx = np.union1d([0], np.minimum(idx, len(cdf) - 1))
+        tables.append((distinct[idx], cdf[idx]))
+    return tables
+
+def _presort(values):
+    """
+    Sorts every column once, for the bootstrap replicates.
+
+    Parameters
+    ----------
+    values : numpy array
+        The data (rows, columns).
+
+    Returns
+    -------
+    list
+        For every column, the sorting order without missing values,
+        the position where every group of ties starts, and the distinct values.
+    """
+    presorted = []
+    for column in np.ascontiguousarray(values.T):
+        order = np.argsort(column)
+        order = order[:np.count_nonzero(~np.isnan(column))]
+        sorted_values = column[order]
+        starts = _tie_starts(sorted_values)
+        presorted.append((order, starts, sorted_values[starts]))
+    return presorted
+
+def _bootstrap_batch(job):
+    """
+    Calculates the weighted quantiles of a batch of bootstrap replicates.
+
+    Parameters
+    ----------
+    job : tuple
+        The presorted columns, the weights, the probabilities, the number of replicates
+        and the random seed of the batch.
+
+    Returns
+    -------
+    numpy array
+        The quantiles (replicates, probabilities, columns).
+    """
+    presorted, weights, probs, replicates, seed = job
+    rng = np.random.default_rng(seed)
+    # Poisson resampling: the number of times every row is drawn, the same rows for all the columns.
+    counts = rng.poisson(1.0, (replicates, len(weights)))
+    results = np.empty((replicates, len(probs), len(presorted)))
+    for j, (order, starts, values) in enumerate(presorted):
+        cweights = np.cumsum(np.add.reduceat(counts[:, order] * weights[order], starts, axis=1), axis=1)
+        for r in range(replicates):
+            results[r, :, j] = _cumulative_quantiles(values, cweights[r], probs, skip_empty=True)
+    return results
+
+def bootstrap_weighted_quantiles(values, weights, probs, replicates=1000, batch=100, alpha=0.05, seed=0,
+                                 workers=1, executor='thread'):
+    """
+    Calculates bootstrap confidence intervals of weighted quantiles of every column.
+
+    Parameters
+    ----------
+    values : array like
+        The data, as a 2-D array (rows, columns) or a 1-D array of a single column.
+    weights : array like
+        The weight of every row.
+    probs : array like
+        The probabilities of the quantiles, between 0 and 1.
+    replicates : int, optional
+        The number of bootstrap replicates. The default is 1000.
+    batch : int, optional
+        The number of replicates calculated together. Every batch holds a (batch, rows) array
+        of resampling counts. The default is 100.
+    alpha : float, optional
+        The confidence intervals are of 1 - alpha. The default is 0.05.
+    seed : int, optional
+        The random seed. The default is 0.
+    workers : int, optional
+        The number of workers calculating batches in parallel. None means the number of CPUs.
+        The default is 1.
+    executor : str, optional
+        'thread' or 'process', see parallel_map. The default is 'thread'.
+
+    Returns
+    -------
+    tuple
+        The lower and upper bounds, each with a row for every probability and a column for every column in the data.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    weights = np.asarray(weights, dtype=float)
+    probs = np.atleast_1d(np.asarray(probs, dtype=float))
+
+    # Sorting every column once, for all the replicates.
+    presorted = _presort(values)
+
+    # Splitting the replicates into batches, with an independent random seed for every batch.
+    sizes = [min(batch, replicates - start) for start in range(0, replicates, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(presorted, weights, probs, size, s) for size, s in zip(sizes, seeds)]
+    replicated = np.concatenate(parallel_map(_bootstrap_batch, jobs, workers, executor))
+
+    lower, upper = np.quantile(replicated, [alpha / 2, 1 - alpha / 2], axis=0)
+    return lower, upper
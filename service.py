@@ -0,0 +1,631 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It serves the expenditure decile classification over HTTP, as an ASGI application.
+
+It performs the following tasks:
+
+Library Imports:
+Imports json and numpy, and load_limits, nefesh_btl, find_rank and classify from classifier.py.
+pyarrow is imported only for Arrow streams. No web framework is needed: the application speaks ASGI directly, and can be run by any ASGI server.
+
+Endpoints:
+GET /health - Returns {"status": "ok"}.
+POST /classify - Classifies a single household:
+{"persons": 4, "expenditures": {"c3": 12000, "c30": 1500}} -> {"deciles": {"c3": 5, "c30": 6}}
+POST /classify/batch - Classifies many households at once, with a list for every field:
+{"persons": [4, 2], "expenditures": {"c3": [12000, 9000]}} -> {"deciles": {"c3": [5, 7]}}
+"persons" must be whole numbers of at least 1. A null (or not finite) expenditure gets a null decile,
+the same as in a stream.
+The expenditures are monthly household expenditures, divided by nefesh_btl(persons) before the lookup,
+the same as in exp_decile.py.
+POST /classify/stream - Classifies a stream of households, and streams the results back while the request
+is still being received, so the memory use does not depend on the number of households. The format is
+chosen by the content type:
+application/x-ndjson - a JSON object for every line, such as {"id": 7, "persons": 4, "c3": 12000},
+answered with a line for every household, such as {"id": 7, "c3_decile": 5}. Lines are limited to MAX_LINE bytes.
+application/vnd.apache.arrow.stream - an Arrow IPC stream with a "persons" column and a column for every
+category, answered with an Arrow IPC stream of int16 '<category>_decile' columns (pyarrow is required).
+An "id" field or column is copied to the results, and missing expenditures get null deciles.
+Invalid requests get a 400 response with an "error" message. An error found after the results started
+ends an NDJSON stream with an "error" line, and an Arrow stream without its end marker.
+
+Function Definitions:
+create_app(limits_file=LIMITS): Loads the limits once and creates the ASGI application.
+request(app, method, path, body=b'', headers=()): An in-process client, which calls the application
+without a server. The body can be given in chunks, to test streaming.
+
+Usage:
+uvicorn service:app --workers 4
+Or, in-process:
+status, body = asyncio.run(request(app, 'POST', '/classify', b'{"persons": 4, "expenditures": {"c3": 12000}}'))
+"""
+
+# Importing the required libraries.
+import json
+import os
+import numpy as np
+from pathlib import Path
+from classifier import load_limits, nefesh_btl, find_rank, classify
+
+# The limits file, which can be replaced with the EXPENDITURE_LIMITS environment variable.
+LIMITS = Path(os.environ.get('EXPENDITURE_LIMITS', Path(__file__).parent / 'data' / 'limits.csv'))
+
+# The largest request body accepted, in bytes.
+MAX_BODY = 64 * 1024 * 1024
+
+def _parse(body, limits):
+    """
+    Parses a classification request.
+
+    Parameters
+    ----------
+    body : bytes
+        The JSON request body.
+    limits : dict
+        The limits of every category.
+
+    Raises
+    ------
+    ValueError
+        If the body is not a valid classification request.
+
+    Returns
+    -------
+    tuple
+        The number of persons and the expenditures of every category.
+    """
+    try:
+        request = json.loads(body)
+        persons, expenditures = request['persons'], request['expenditures']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('the body must be a JSON object with "persons" and "expenditures"')
+    if not isinstance(expenditures, dict) or not expenditures:
+        raise ValueError('"expenditures" must be an object of categories and expenditures')
+    unknown = [c for c in expenditures if c not in limits]
+    if unknown:
+        raise ValueError(f'unknown categories: {", ".join(unknown)}')
+    return persons, expenditures
+
+def classify_single(body, limits):
+    """
+    Classifies a single household.
+
+    Parameters
+    ----------
+    body : bytes
+        The JSON request body.
+    limits : dict
+        The limits of every category, as lists for the fastest single value lookup.
+
+    Returns
+    -------
+    dict
+        The decile of every category, None for a missing (null or not finite) expenditure.
+    """
+    persons, expenditures = _parse(body, limits)
+    if isinstance(persons, bool) or not isinstance(persons, (int, float)) or not float(persons).is_integer() or persons < 1:
+        raise ValueError('"persons" must be a whole number of at least 1')
+    scale = nefesh_btl(int(persons))
+    try:
+        exp_pp = {c : np.nan if v is None else float(v) / scale for c, v in expenditures.items()}
+    except (TypeError, ValueError):
+        raise ValueError('every expenditure must be a number or null')
+    return {'deciles' : {c : find_rank(limits[c], v) if np.isfinite(v) else None for c, v in exp_pp.items()}}
+
+def classify_batch(body, limits):
+    """
+    Classifies many households.
+
+    Parameters
+    ----------
+    body : bytes
+        The JSON request body.
+    limits : dict
+        The limits of every category.
+
+    Returns
+    -------
+    dict
+        The deciles of every category, as lists in the order of the households,
+        with None for missing (null or not finite) expenditures.
+    """
+    persons, expenditures = _parse(body, limits)
+    try:
+        sizes = np.asarray(persons, dtype=float)
+        # Nulls become NaN, the same as missing expenditures of a stream.
+        exp_pp = {c : np.asarray(v, dtype=float) for c, v in expenditures.items()}
+    except (TypeError, ValueError):
+        sizes = exp_pp = None
+    if sizes is None or sizes.ndim != 1 or any(v.shape != sizes.shape for v in exp_pp.values()):
+        raise ValueError('"persons" and every expenditure must be lists of numbers of the same length')
+    if not ((sizes >= 1) & (sizes == np.floor(sizes))).all():
+        raise ValueError('every number of persons must be a whole number of at least 1')
+    scale = nefesh_btl(sizes.astype(np.intp))
+    exp_pp = {c : v / scale for c, v in exp_pp.items()}
+    deciles = {}
+    for c, r in classify(limits, exp_pp).items():
+        deciles[c] = [d if ok else None for d, ok in zip(r.tolist(), np.isfinite(exp_pp[c]).tolist())]
+    return {'deciles' : deciles}
+
+async def _read_body(receive):
+    """
+    Reads the whole request body.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+
+    Returns
+    -------
+    bytes or None
+        The body, or None if it is larger than MAX_BODY.
+    """
+    body = bytearray()
+    more = True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+        if len(body) > MAX_BODY:
+            return None
+    return bytes(body)
+
+async def _respond(send, status, content):
+    """
+    Sends a JSON response.
+
+    Parameters
+    ----------
+    send : function
+        The ASGI send function.
+    status : int
+        The HTTP status.
+    content : dict
+        The response, to be sent as JSON.
+    """
+    body = json.dumps(content).encode()
+    await send({'type' : 'http.response.start',
+                'status' : status,
+                'headers' : [(b'content-type', b'application/json'),
+                             (b'content-length', str(len(body)).encode())]})
+    await send({'type' : 'http.response.body', 'body' : body})
+
+async def _lifespan(receive, send):
+    """
+    Answers the ASGI lifespan messages of the server.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+    send : function
+        The ASGI send function.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type' : 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type' : 'lifespan.shutdown.complete'})
+            return
+
+# The number of NDJSON households classified together in a stream.
+STREAM_BATCH = 10_000
+
+# The longest NDJSON line of a stream, in bytes, so a stream without new lines cannot fill the memory.
+MAX_LINE = 1024 * 1024
+
+# The content types of streams.
+NDJSON = 'application/x-ndjson'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+# The end of an Arrow IPC stream.
+ARROW_EOS = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+def _classify_columns(persons, expenditures, limits):
+    """
+    Classifies a batch of households of a stream.
+
+    Parameters
+    ----------
+    persons : array like
+        The number of persons of every household.
+    expenditures : dict
+        The expenditures of every category, with NaN for missing expenditures.
+    limits : dict
+        The limits of every category.
+
+    Raises
+    ------
+    ValueError
+        If a category is unknown, or a household does not have a whole number of at least one person.
+
+    Returns
+    -------
+    dict
+        The deciles of every category, and a mask of the missing expenditures.
+    """
+    unknown = [c for c in expenditures if c not in limits]
+    if unknown:
+        raise ValueError(f'unknown categories: {", ".join(unknown)}')
+    sizes = np.asarray(persons, dtype=float)
+    if not ((sizes >= 1) & (sizes == np.floor(sizes))).all():
+        raise ValueError('every household must have "persons" as a whole number of at least 1')
+    scale = nefesh_btl(sizes.astype(np.intp))
+    deciles = {}
+    for c, v in expenditures.items():
+        v = np.asarray(v, dtype=float)
+        deciles[c] = find_rank(limits[c], v / scale), ~np.isfinite(v)
+    return deciles
+
+def _has_pyarrow():
+    """
+    Checks whether pyarrow, which is needed only for Arrow streams, is installed.
+
+    Returns
+    -------
+    bool
+        True if pyarrow can be imported.
+    """
+    from importlib.util import find_spec
+    return find_spec('pyarrow') is not None
+
+async def _body_chunks(receive):
+    """
+    Reads the request body chunk by chunk, as the server receives it.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+
+    Yields
+    ------
+    bytes
+        A chunk of the body.
+    """
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        yield message.get('body', b'')
+        more = message.get('more_body', False)
+
+def _ndjson_output(records, limits):
+    """
+    Classifies a batch of NDJSON households.
+
+    Parameters
+    ----------
+    records : list
+        The households, as dicts of "persons", an optional "id" and the expenditure of every category.
+    limits : dict
+        The limits of every category.
+
+    Returns
+    -------
+    bytes
+        An NDJSON line for every household, with its "id" and '<category>_decile' fields.
+    """
+    try:
+        persons = [r['persons'] for r in records]
+        categories = list(dict.fromkeys(c for r in records for c in r if c not in ('persons', 'id')))
+        expenditures = {c : [r.get(c, np.nan) for r in records] for c in categories}
+        deciles = _classify_columns(persons, expenditures, limits)
+    except (TypeError, KeyError):
+        raise ValueError('every line must be a JSON object with "persons" and the expenditure of every category')
+    lines = []
+    for i, r in enumerate(records):
+        line = {'id' : r['id']} if 'id' in r else {}
+        for c, (ranks, missing) in deciles.items():
+            line[c + '_decile'] = None if missing[i] else int(ranks[i])
+        lines.append(json.dumps(line))
+    return ('\n'.join(lines) + '\n').encode()
+
+async def _ndjson_stream(receive, limits):
+    """
+    Classifies an NDJSON stream of households, a batch at a time.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+    limits : dict
+        The limits of every category.
+
+    Yields
+    ------
+    bytes
+        The NDJSON results of every batch.
+
+    Raises
+    ------
+    ValueError
+        If a line is longer than MAX_LINE bytes, or is not valid JSON.
+    """
+    # The pieces of the line which is not complete yet, so only the new chunk is searched for new lines.
+    pending = []
+    pending_size = 0
+    records = []
+    async for chunk in _body_chunks(receive):
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            size = pending_size + (len(chunk) if end < 0 else end) - start
+            if size > MAX_LINE:
+                raise ValueError(f'a line of the stream is longer than {MAX_LINE} bytes')
+            if end < 0:
+                pending.append(chunk[start:])
+                pending_size = size
+                break
+            line = b''.join(pending) + chunk[start : end]
+            pending = []
+            pending_size = 0
+            start = end + 1
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) >= STREAM_BATCH:
+                yield _ndjson_output(records, limits)
+                records = []
+    rest = b''.join(pending)
+    if rest.strip():
+        records.append(json.loads(rest))
+    if records:
+        yield _ndjson_output(records, limits)
+
+def _arrow_messages(buffer, pa):
+    """
+    Reads the complete Arrow IPC messages at the start of a buffer, and removes them from it.
+
+    Parameters
+    ----------
+    buffer : bytearray
+        The received bytes which were not read yet.
+    pa : module
+        pyarrow.
+
+    Returns
+    -------
+    tuple
+        The messages, and whether the end of the stream was reached.
+    """
+    data = pa.py_buffer(bytes(buffer))
+    reader = pa.BufferReader(data)
+    messages = []
+    end = False
+    while True:
+        position = reader.tell()
+        if data.size - position < 8:
+            break
+        if data[position : position + 8].to_pybytes() == ARROW_EOS:
+            position += 8
+            end = True
+            break
+        try:
+            messages.append(pa.ipc.read_message(reader))
+        except (pa.ArrowInvalid, OSError, EOFError):
+            # The rest of the message was not received yet.
+            break
+    del buffer[:position]
+    return messages, end
+
+def _arrow_output(batch, limits, pa):
+    """
+    Classifies an Arrow record batch of households.
+
+    Parameters
+    ----------
+    batch : RecordBatch
+        The households, with a "persons" column, an optional "id" column and a column for every category.
+    limits : dict
+        The limits of every category.
+    pa : module
+        pyarrow.
+
+    Returns
+    -------
+    RecordBatch
+        The "id" column and a '<category>_decile' column for every category, with nulls for missing expenditures.
+    """
+    names = batch.schema.names
+    if 'persons' not in names:
+        raise ValueError('the Arrow stream must have a "persons" column')
+    expenditures = {c : batch.column(c).to_numpy(zero_copy_only=False) for c in names if c not in ('persons', 'id')}
+    deciles = _classify_columns(batch.column('persons').to_numpy(zero_copy_only=False), expenditures, limits)
+    columns = {'id' : batch.column('id')} if 'id' in names else {}
+    for c, (ranks, missing) in deciles.items():
+        columns[c + '_decile'] = pa.array(ranks.astype(np.int16), mask=missing)
+    return pa.RecordBatch.from_pydict(columns)
+
+async def _arrow_stream(receive, limits):
+    """
+    Classifies an Arrow IPC stream of households, a record batch at a time.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+    limits : dict
+        The limits of every category.
+
+    Yields
+    ------
+    bytes
+        The Arrow IPC stream of the results: the schema, a record batch for every record batch received,
+        and the end of the stream.
+    """
+    import pyarrow as pa
+    buffer = bytearray()
+    schema = None
+    # Reading is tried again only after the buffer doubles, so a large message is not parsed again and again.
+    next_read = 0
+    chunks = _body_chunks(receive)
+    more = True
+    while more:
+        try:
+            buffer += await chunks.__anext__()
+        except StopAsyncIteration:
+            more = False
+        if more and len(buffer) < next_read:
+            continue
+        messages, end = _arrow_messages(buffer, pa)
+        next_read = 2 * len(buffer)
+        for message in messages:
+            if schema is None:
+                if message.type != 'schema':
+                    raise ValueError('the Arrow stream must start with a schema')
+                schema = pa.ipc.read_schema(message)
+                # The schema of the results is sent at once, from the results of an empty record batch.
+                empty = pa.record_batch([pa.array([], type=f.type) for f in schema], schema=schema)
+                yield _arrow_output(empty, limits, pa).schema.serialize().to_pybytes()
+                continue
+            if message.type != 'record batch':
+                raise ValueError(f'unsupported Arrow message: {message.type}')
+            batch = _arrow_output(pa.ipc.read_record_batch(message, schema), limits, pa)
+            yield batch.serialize().to_pybytes()
+        if end:
+            break
+    if schema is None:
+        raise ValueError('the Arrow stream has no schema')
+    if buffer:
+        raise ValueError('the Arrow stream ended in the middle of a message')
+    yield ARROW_EOS
+
+async def _stream(receive, send, limits, content_type):
+    """
+    Classifies a stream of households and streams the results back, one batch at a time.
+
+    Parameters
+    ----------
+    receive : function
+        The ASGI receive function.
+    send : function
+        The ASGI send function.
+    limits : dict
+        The limits of every category.
+    content_type : str
+        NDJSON or ARROW.
+    """
+    stream = _ndjson_stream if content_type == NDJSON else _arrow_stream
+    started = False
+    try:
+        async for output in stream(receive, limits):
+            if not started:
+                await send({'type' : 'http.response.start',
+                            'status' : 200,
+                            'headers' : [(b'content-type', content_type.encode())]})
+                started = True
+            await send({'type' : 'http.response.body', 'body' : output, 'more_body' : True})
+    except ValueError as e:
+        if not started:
+            await _respond(send, 400, {'error' : str(e)})
+            return
+        # The status was already sent: an NDJSON error line, or an Arrow stream without its end.
+        tail = (json.dumps({'error' : str(e)}) + '\n').encode() if content_type == NDJSON else b''
+        await send({'type' : 'http.response.body', 'body' : tail, 'more_body' : False})
+        return
+    if not started:
+        await send({'type' : 'http.response.start',
+                    'status' : 200,
+                    'headers' : [(b'content-type', content_type.encode())]})
+    await send({'type' : 'http.response.body', 'body' : b'', 'more_body' : False})
+
+def create_app(limits_file=LIMITS):
+    """
+    Creates the ASGI application.
+
+    Parameters
+    ----------
+    limits_file : Path object, optional
+        The limits file, loaded once for all the requests. The default is LIMITS.
+
+    Returns
+    -------
+    function
+        The ASGI application.
+    """
+    limits = load_limits(limits_file)
+    # Single households are classified fastest with the limits as lists, and batches with arrays.
+    limits_lists = {c : l.tolist() for c, l in limits.items()}
+    routes = {('POST', '/classify') : (classify_single, limits_lists),
+              ('POST', '/classify/batch') : (classify_batch, limits)}
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await _lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == '/health':
+            await _respond(send, 200, {'status' : 'ok'})
+            return
+        if (scope['method'], scope['path']) == ('POST', '/classify/stream'):
+            content_type = dict(scope['headers']).get(b'content-type', b'').decode().split(';')[0].strip()
+            if content_type not in (NDJSON, ARROW) or (content_type == ARROW and not _has_pyarrow()):
+                await _respond(send, 415, {'error' : f'the content type must be {NDJSON} or {ARROW}'})
+                return
+            await _stream(receive, send, limits, content_type)
+            return
+        handler, handler_limits = routes.get((scope['method'], scope['path']), (None, None))
+        if handler is None:
+            allowed = scope['path'] == '/classify/stream' or any(path == scope['path'] for method, path in routes)
+            await _respond(send, 405 if allowed else 404, {'error' : 'method not allowed' if allowed else 'not found'})
+            return
+        body = await _read_body(receive)
+        if body is None:
+            await _respond(send, 413, {'error' : f'the body is larger than {MAX_BODY} bytes'})
+            return
+        try:
+            content = handler(body, handler_limits)
+        except ValueError as e:
+            await _respond(send, 400, {'error' : str(e)})
+            return
+        await _respond(send, 200, content)
+
+    return app
+
+async def request(app, method, path, body=b'', headers=()):
+    """
+    Calls the application in-process, without a server.
+
+    Parameters
+    ----------
+    app : function
+        The ASGI application.
+    method : str
+        The HTTP method.
+    path : str
+        The request path.
+    body : bytes or iterable, optional
+        The request body, or the chunks of a streamed request body. The default is b''.
+    headers : iterable, optional
+        The request headers, as (name, value) pairs of bytes. The default is ().
+
+    Returns
+    -------
+    tuple
+        The response status and body.
+    """
+    scope = {'type' : 'http', 'method' : method, 'path' : path, 'headers' : list(headers)}
+    chunks = [body] if isinstance(body, bytes) else list(body) or [b'']
+    messages = [{'type' : 'http.request', 'body' : c, 'more_body' : i < len(chunks) - 1} for i, c in enumerate(chunks)]
+    response = {'status' : None, 'body' : bytearray()}
+
+    async def receive():
+        return messages.pop(0) if messages else {'type' : 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response['status'], bytes(response['body'])
+
+app = create_app()
@@ -0,0 +1,200 @@
+"""
+Script by: Tom Sadeh.
+If you have any questions, send an email to dtsj89@gmail.com
+
+This script is part of the Expenditure Decile Calculator Project.
+It generates synthetic Expenditure Survey files of any size, for reproducing and scale-testing data_creation.py
+without the real survey.
+
+It performs the following tasks:
+
+Library Imports:
+Imports pandas and numpy, nefesh_btl from classifier.py and parallel_map from quantiles.py.
+pyarrow is imported only for Parquet files.
+
+Distribution Fitting:
+Fits a quantile function to the published limits of every category: linear between 0 at p = 0 and the limits,
+and a Pareto tail above the last limit, with the shape fitted to the last two limits.
+The open upper limit (p = 1.0) is not a real limit and is ignored.
+
+Household Generation:
+Draws the number of persons of every household from HOUSEHOLD_SIZES, its 'nefeshstandartit' with nefesh_btl,
+and a random weight, so the weights of all the households add up to --households.
+Draws the per-person expenditure of every category from its quantile function, independently of the weight,
+so the weighted deciles of the synthetic survey converge to the published limits.
+The expenditures are monthly household expenditures, rounded to whole shekels, as in the survey.
+The categories are drawn independently of each other.
+
+Writing:
+The survey is generated in chunks of --chunksize households, each with a random seed of its own,
+so the file does not depend on the number of workers. Every --workers chunks are generated
+(and, for CSV, formatted) in parallel, and then appended in order to the CSV or Parquet file,
+so only a few chunks are held in memory at a time.
+
+Usage:
+python survey_generator.py survey.csv --rows 1000000
+python survey_generator.py survey.parquet --rows 600000 --workers 8 --executor process
+"""
+
+# Importing the required libraries.
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from classifier import nefesh_btl
+from quantiles import parallel_map
+
+# The share of households of every number of persons, from 1 to 8, roughly as in the survey.
+HOUSEHOLD_SIZES = [0.20, 0.25, 0.16, 0.15, 0.11, 0.07, 0.04, 0.02]
+
+# The number of households in Israel, which the weights add up to by default.
+HOUSEHOLDS = 2_800_000
+
+# The limits of the shape of the Pareto tails.
+TAIL_SHAPE = (1.5, 10.0)
+
+def fit_quantile_functions(file):
+    """
+    Fits a quantile function to the limits of every category.
+
+    Parameters
+    ----------
+    file : Path object
+        The limits file, such as limits.csv.
+
+    Returns
+    -------
+    dict
+        The quantiles, the limits and the shape of the Pareto tail of every category.
+    """
+    limits = pd.read_csv(file, index_col='p', float_precision='round_trip')
+    limits = limits[limits.index < 1]
+    probs = np.concatenate([[0], limits.index.to_numpy(dtype=float)])
+    fits = {}
+    for c in limits.columns:
+        values = np.concatenate([[0], limits[c].to_numpy(dtype=float)])
+        # The Pareto quantile function x * (1 - p) ** (-1 / shape) through the last two limits.
+        if values[-2] > 0 and values[-1] > values[-2]:
+            shape = np.log((1 - probs[-2]) / (1 - probs[-1])) / np.log(values[-1] / values[-2])
+        else:
+            shape = TAIL_SHAPE[1]
+        fits[c] = probs, values, float(np.clip(shape, *TAIL_SHAPE))
+    return fits
+
+def sample_expenditures(fit, u):
+    """
+    Finds the per-person expenditures at uniform random numbers.
+
+    Parameters
+    ----------
+    fit : tuple
+        The quantile function of a category, as fitted by fit_quantile_functions.
+    u : numpy array
+        Uniform random numbers in [0, 1).
+
+    Returns
+    -------
+    numpy array
+        The per-person expenditures.
+    """
+    probs, values, shape = fit
+    expenditures = np.interp(u, probs, values)
+    tail = u > probs[-1]
+    expenditures[tail] = values[-1] * ((1 - probs[-1]) / (1 - u[tail])) ** (1 / shape)
+    return expenditures
+
+def generate_chunk(job):
+    """
+    Generates a chunk of the synthetic survey.
+
+    Parameters
+    ----------
+    job : tuple
+        The quantile functions, the number of the first household, the number of households,
+        the weight of an average household, the random seed and the file suffix.
+
+    Returns
+    -------
+    DataFrame or str
+        The chunk, as CSV text without a header for a '.csv' suffix.
+    """
+    fits, start, rows, weight, seed, suffix = job
+    rng = np.random.default_rng(seed)
+    nefesh = rng.choice(np.arange(1, len(HOUSEHOLD_SIZES) + 1), rows, p=HOUSEHOLD_SIZES)
+    scale = nefesh_btl(nefesh)
+    chunk = {'misparmb' : np.arange(start, start + rows), 'nefesh' : nefesh, 'nefeshstandartit' : scale}
+    for c, fit in fits.items():
+        chunk[c] = np.round(sample_expenditures(fit, rng.random(rows)) * scale)
+    chunk['weight'] = rng.uniform(0.5, 1.5, rows) * weight
+    chunk = pd.DataFrame(chunk)
+    return chunk.to_csv(header=False, index=False) if suffix == '.csv' else chunk
+
+def write_survey(file, rows, fits, chunksize=1_000_000, households=HOUSEHOLDS, seed=0, workers=1, executor='thread'):
+    """
+    Generates a synthetic survey and writes it to a CSV or Parquet file.
+
+    Parameters
+    ----------
+    file : Path object
+        The file to write to. Overwritten if it already exists.
+    rows : int
+        The number of households.
+    fits : dict
+        The quantile functions, as fitted by fit_quantile_functions.
+    chunksize : int, optional
+        The number of households in every chunk. The default is 1,000,000.
+    households : int, optional
+        The number of households the weights add up to, on average. The default is HOUSEHOLDS.
+    seed : int, optional
+        The random seed. The default is 0.
+    workers : int, optional
+        The number of workers generating chunks in parallel. None means the number of CPUs. The default is 1.
+    executor : str, optional
+        'thread' or 'process'. The default is 'thread'.
+    """
+    jobs = [(fits, start, min(chunksize, rows - start), households / rows, (seed, i), file.suffix)
+            for i, start in enumerate(range(0, rows, chunksize))]
+    # Every window of chunks is generated in parallel, and written before the next one is generated.
+    window = workers or os.cpu_count()
+    writer = None
+    try:
+        if file.suffix == '.csv':
+            with open(file, 'w', newline='') as f:
+                f.write(','.join(['misparmb', 'nefesh', 'nefeshstandartit'] + list(fits) + ['weight']) + '\n')
+                for i in range(0, len(jobs), window):
+                    for text in parallel_map(generate_chunk, jobs[i : i + window], workers, executor):
+                        f.write(text)
+        elif file.suffix == '.parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            for i in range(0, len(jobs), window):
+                for chunk in parallel_map(generate_chunk, jobs[i : i + window], workers, executor):
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(file, table.schema)
+                    writer.write_table(table)
+        else:
+            raise ValueError(f'{file} must be a .csv or .parquet file')
+    finally:
+        if writer is not None:
+            writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates a synthetic Expenditure Survey file, fitted to the published limits.')
+    parser.add_argument('output', type=Path, help='The survey file to write (.csv or .parquet).')
+    parser.add_argument('--rows', type=int, default=6_000, help='The number of households.')
+    parser.add_argument('--limits', type=Path, default=Path('./data/limits.csv'), help='The limits file to fit the distributions to.')
+    parser.add_argument('--households', type=int, default=HOUSEHOLDS, help='The number of households the weights add up to.')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='The number of households generated at a time.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+    parser.add_argument('--workers', type=int, default=1, help='The number of workers generating chunks in parallel. 0 means the number of CPUs.')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread', help='Run the workers as threads or as processes.')
+    args = parser.parse_args(argv)
+
+    fits = fit_quantile_functions(args.limits)
+    write_survey(args.output, args.rows, fits, args.chunksize, args.households, args.seed, args.workers or None, args.executor)
+    print(f'Generated {args.rows} households into {args.output}')
+
+if __name__ == '__main__':
+    main()